@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Прогон агентов на локальных заглушках в headless Chromium
+
+Пример:
+    python bench/agent_harness.py --scenarios perplexity,aistudio,rulate --chapters 10 --out agents.json
+    python bench/compare_results.py agents_old.json agents.json
+
+Сценарии:
+    perplexity        inlands_bridge.perplexity_worker
+    aistudio          inlands_bridge.aistudio_worker
+    local_perplexity  local_bridge_agent.translate_worker
+    rulate            local_bridge_agent.publish_chapter
+
+Заглушки (bench/mock_sites.py) поднимаются в этом же процессе, адреса сайтов
+в модулях агентов подменяются на них. Этапы берутся из спанов, которые пишут
+сами агенты, так что отчёт совпадает с водопадом /api/traces на сервере.
+Нужны: pip install httpx playwright && playwright install chromium
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "public"))
+
+from playwright.async_api import async_playwright
+
+import inlands_bridge
+import local_bridge_agent
+from gen_corpus import chapter_original, make_glossary
+from load_server import git_revision, percentile
+from mock_sites import MockConfig, start_mock_server
+
+SCENARIOS = ("perplexity", "aistudio", "local_perplexity", "rulate")
+SYSTEM_PROMPT = "Переведи текст с китайского на русский, соблюдая глоссарий."
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "errors": 0,
+        "mean_ms": round(sum(values) / len(values), 2),
+        "p50_ms": round(percentile(values, 0.50), 2),
+        "p95_ms": round(percentile(values, 0.95), 2),
+        "p99_ms": round(percentile(values, 0.99), 2),
+        "max_ms": round(max(values), 2),
+    }
+
+
+def make_chapters(n, chars, seed):
+    rnd = random.Random(seed)
+    glossary = make_glossary(rnd)[:50]
+    chapters = [{
+        "id": f"mock-ch{i:04d}",
+        "number": i,
+        "title": f"Глава {i}",
+        "original_text": chapter_original(rnd, chars),
+        "translated_text": "Переведённый текст главы. " * (chars // 10)
+    } for i in range(1, n + 1)]
+    return chapters, glossary
+
+
+def full_prompt(chapter, glossary):
+    glossary_text = "\n".join(f"{g['original']} = {g['russian-translation']}" for g in glossary)
+    return f"{SYSTEM_PROMPT}\n\nГлоссарий:\n{glossary_text}\n\nТекст для перевода:\n{chapter['original_text']}"
+
+
+def published_on_mock(config, chapter):
+    """Дошла ли глава до подтверждения на заглушке Rulate: publish_chapter сообщает
+    success и тогда, когда POST /new вернул 500"""
+    with config.lock:
+        return any(p["title"] == chapter["title"] for p in config.stats["published"])
+
+
+async def run_one(scenario, context, chapter, glossary, config, mock_url, spans):
+    """Одна глава через выбранного агента; True, если получен непустой результат"""
+    task_id = f"{scenario}-{chapter['id']}"
+    if scenario == "perplexity":
+        return bool(await inlands_bridge.perplexity_worker(context, full_prompt(chapter, glossary), task_id, spans))
+    if scenario == "aistudio":
+        return bool(await inlands_bridge.aistudio_worker(context, full_prompt(chapter, glossary), task_id, spans))
+
+    with local_bridge_agent.trace_span(spans, "page_create"):
+        page = await context.new_page()
+    try:
+        if scenario == "local_perplexity":
+            job = {"chapters": [chapter], "glossary": glossary, "prompt": SYSTEM_PROMPT}
+            results = await local_bridge_agent.translate_worker(page, job, spans)
+            text = results[0]["translated_text"] if results else ""
+            return bool(text) and not text.startswith("[ОШИБКА")
+        if scenario == "rulate":
+            with local_bridge_agent.trace_span(spans, "publish_chapter", chapter_id=chapter["id"]):
+                result = await local_bridge_agent.publish_chapter(page, f"{mock_url}/rulate/book/1", chapter, {
+                    "chapter_status": "ready",
+                    "delayed_chapter": True,
+                    "subscription_only": True,
+                    "add_as_translation": True
+                })
+            return result.get("success", False) and published_on_mock(config, chapter)
+    finally:
+        await page.close()
+    raise ValueError(f"Неизвестный сценарий: {scenario}")
+
+
+async def run_scenario(scenario, context, chapters, glossary, config, mock_url, concurrency, timeout):
+    sem = asyncio.Semaphore(concurrency)
+    spans = []
+    outcomes = []
+
+    async def worker(ch):
+        async with sem:
+            try:
+                # Без таймаута пустой ответ или 500 держат воркер агента до его собственного
+                # лимита ожидания (20–40 минут)
+                outcomes.append(await asyncio.wait_for(
+                    run_one(scenario, context, ch, glossary, config, mock_url, spans), timeout))
+            except asyncio.TimeoutError:
+                print(f"  ⏱ {scenario} {ch['id']}: нет результата за {timeout}с")
+                outcomes.append(False)
+            except Exception as e:
+                print(f"  ❌ {scenario} {ch['id']}: {e}")
+                outcomes.append(False)
+
+    started = time.monotonic()
+    await asyncio.gather(*[worker(ch) for ch in chapters])
+    wall = time.monotonic() - started
+
+    by_stage = {}
+    for sp in spans:
+        by_stage.setdefault(sp["stage"], []).append(sp["duration_ms"])
+    ok = sum(outcomes)
+    return {
+        "chapters": len(chapters),
+        "ok": ok,
+        "failed": len(chapters) - ok,
+        "wall_s": round(wall, 2),
+        "chapters_per_min": round(ok / wall * 60, 2) if wall else 0,
+        "stages": {stage: summarize(v) for stage, v in sorted(by_stage.items())},
+    }
+
+
+async def run(args, config, mock_url):
+    # Агенты ходят на реальные сайты по константам модулей: подменяем на заглушки
+    inlands_bridge.SERVER_URL = mock_url
+    inlands_bridge.PERPLEXITY_URL = f"{mock_url}/perplexity/"
+    inlands_bridge.AISTUDIO_URL = f"{mock_url}/aistudio/"
+    local_bridge_agent.PERPLEXITY_URL = f"{mock_url}/perplexity/"
+
+    chapters, glossary = make_chapters(args.chapters, args.chars, args.seed)
+    report = {}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=not args.headful)
+        context = await browser.new_context()
+        try:
+            for scenario in args.scenarios:
+                print(f"\n🧪 {scenario}: {len(chapters)} глав, {args.concurrency} вкладок")
+                report[scenario] = await run_scenario(scenario, context, chapters, glossary, config, mock_url,
+                                                      args.concurrency, args.chapter_timeout)
+                r = report[scenario]
+                print(f"   ✅ {r['ok']}/{r['chapters']} за {r['wall_s']}с → {r['chapters_per_min']} глав/мин")
+        finally:
+            await browser.close()
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Прогон агентов на локальных заглушках")
+    ap.add_argument("--scenarios", default="perplexity,aistudio,rulate",
+                    help=f"через запятую из: {', '.join(SCENARIOS)}")
+    ap.add_argument("--chapters", type=int, default=5, help="глав на сценарий")
+    ap.add_argument("--chars", type=int, default=3000, help="символов в оригинале главы")
+    ap.add_argument("--concurrency", type=int, default=inlands_bridge.MAX_CONCURRENT_JOBS)
+    ap.add_argument("--latency", type=float, default=1.0, help="секунд до первого токена")
+    ap.add_argument("--chunk-delay", type=float, default=0.05)
+    ap.add_argument("--answer-chars", type=int, default=6000)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--chapter-timeout", type=float, default=180.0, help="секунд на главу, дальше она считается неудачной")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--headful", action="store_true", help="показывать окно браузера")
+    ap.add_argument("--out", default="agent_results.json")
+    args = ap.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    config = MockConfig(latency=args.latency, chunk_delay=args.chunk_delay, answer_chars=args.answer_chars,
+                        fail_rate=args.fail_rate, seed=args.seed)
+    server, mock_url = start_mock_server(config)
+    try:
+        report = asyncio.run(run(args, config, mock_url))
+    finally:
+        server.shutdown()
+
+    ops = {f"{scenario}.{stage}": stats
+           for scenario, r in report.items() for stage, stats in r["stages"].items()}
+    total_ok = sum(r["ok"] for r in report.values())
+    total_wall = sum(r["wall_s"] for r in report.values())
+    result = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scenarios": args.scenarios,
+            "chapters": args.chapters,
+            "chars": args.chars,
+            "concurrency": args.concurrency,
+            "mock": {"latency": args.latency, "chunk_delay": args.chunk_delay,
+                     "answer_chars": args.answer_chars, "fail_rate": args.fail_rate},
+            "mock_stats": {k: v for k, v in config.stats.items() if k != "published"},
+        },
+        "chapters_per_min": round(total_ok / total_wall * 60, 2) if total_wall else 0,
+        "scenarios": report,
+        "ops": ops,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'этап':<34}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for op, o in ops.items():
+        print(f"{op:<34}{o['count']:>6}{o['p50_ms']:>10.1f}{o['p95_ms']:>10.1f}{o['p99_ms']:>10.1f}")
+    print(f"\n⚡ {result['chapters_per_min']} глав/мин, 💾 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
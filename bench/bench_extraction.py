@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк извлечения ответа: старый путь (inner_html на каждом опросе + markdownify
+в конце) против блочного (EXTRACT_BLOCKS_JS с передачей только новых блоков + MarkdownStream)
+
+Пример:
+    python bench/bench_extraction.py --answer-chars 40000 --polls 60
+    python bench/bench_extraction.py --browser     # замер через CDP в headless Chromium
+
+Без --browser блоки строятся в Python из того же ответа, что отдаёт bench/mock_sites.py,
+и считаются время сериализации снимков на опросах (poll_ms), объём передачи и время конвертации. Каждый четвёртый абзац ответа заменяется
+списком (в том числе вложенным), абзацем с <br> и жирным, инлайн-кодом или <pre>; --plain
+оставляет только заголовки и абзацы с курсивом. С --browser ответ растёт прямо
+на странице, и замеряются реальные вызовы page.inner_html / page.evaluate.
+Нужны markdownify (для старого пути), а также httpx и playwright и без --browser:
+их импортирует inlands_bridge. Для --browser нужен ещё chromium (playwright install chromium).
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import os
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "public"))
+
+from markdownify import markdownify as md
+
+from inlands_bridge import EXTRACT_BLOCKS_JS, MarkdownStream, read_answer
+from mock_sites import MockConfig
+
+EM_RE = re.compile(r"\*([^*]+)\*")
+
+
+def list_block(tag, items, depth=0, indent=0):
+    """<ul>/<ol> из пунктов (текст, вложенные пункты или None) и его блоки"""
+    out_html, out_blocks = [], []
+    for n, (text, sub) in enumerate(items, 1):
+        num = n if tag == "ol" else 0
+        inner_html, inner_blocks = list_block(tag, sub, depth + 1, indent + (len(str(n)) + 2 if num else 2)) if sub else ("", [])
+        out_html.append(f"<li><strong>{html.escape(text)}</strong>{inner_html}</li>" if n == 1
+                        else f"<li>{html.escape(text)}{inner_html}</li>")
+        out_blocks.append({"k": "li", "l": num, "d": depth, "w": indent, "s": n == 1 and depth == 0,
+                           "r": [[text, 1 if n == 1 else 0]]})
+        out_blocks.extend(inner_blocks)
+    return f"<{tag}>" + "".join(out_html) + f"</{tag}>", out_blocks
+
+
+def rich_block(words, kind):
+    """Списки, <br>, жирный, код и <hr> — то, чего нет в простом ответе заглушки"""
+    w = [word.strip("*.") for word in words]
+    if kind in (0, 1):
+        tag = "ul" if kind == 0 else "ol"
+        items = [(w[0], None), (" ".join(w[1:3]), [(w[3], None), (w[4], None)]), (" ".join(w[5:8]), None)]
+        html_list, blocks = list_block(tag, items)
+        return [html_list], blocks
+    if kind == 2:
+        first, bold, rest = " ".join(w[0:3]), " ".join(w[3:5]), " ".join(w[5:8])
+        return ([f"<p>{first}<br>{rest} <strong>{bold}</strong></p>"],
+                [{"k": "p", "r": [[first, 0], ["\n", -1], [rest + " ", 0], [bold, 1]]}])
+    if kind == 3:
+        text = " ".join(w[0:4])
+        return ([f"<p>{text} <code>get_job(*args)</code> {w[4]}</p>"],
+                [{"k": "p", "r": [[text + " ", 0], ["get_job(*args)", 4], [" " + w[4], 0]]}])
+    if kind == 4:
+        text = " ".join(w[0:6])
+        return ["<hr>", f"<p>{text}</p>"], [{"k": "hr", "r": []}, {"k": "p", "r": [[text, 0]]}]
+    code = f"def {w[0]}():\n    return {w[1]!r}\n"
+    return ([f"<pre><code>{html.escape(code)}</code></pre>"], [{"k": "pre", "r": [[code, 4]]}])
+
+
+def answer_blocks(chars, seed, rich=True):
+    """Ответ заглушки: (html блоков, блоки в формате EXTRACT_BLOCKS_JS).
+    С rich каждый четвёртый абзац заменяется списком, переносом строки, кодом и т. п."""
+    text = MockConfig(answer_chars=chars, seed=seed).answer_text()
+    html_blocks, blocks = [], []
+    for i, part in enumerate(text.split("\n\n")):
+        if part.startswith("## "):
+            html_blocks.append(f"<h2>{html.escape(part[3:])}</h2>")
+            blocks.append({"k": "h", "l": 2, "r": [[part[3:], 0]]})
+            continue
+        if rich and i % 4 == 0:
+            extra_html, extra_blocks = rich_block(part.split(), i // 4 % 6)
+            html_blocks.extend(extra_html)
+            blocks.extend(extra_blocks)
+            continue
+        runs, pos = [], 0
+        for m in EM_RE.finditer(part):
+            runs.append([part[pos:m.start()], 0])
+            runs.append([m.group(1), 2])
+            pos = m.end()
+        runs.append([part[pos:], 0])
+        html_blocks.append("<p>" + EM_RE.sub(r"<em>\1</em>", html.escape(part)) + "</p>")
+        blocks.append({"k": "p", "r": [r for r in runs if r[0]]})
+    return html_blocks, blocks
+
+
+def visible_count(total, polls, i):
+    """Сколько блоков уже сгенерировано к опросу i"""
+    return max(1, round(total * (i + 1) / polls))
+
+
+def bench_offline(html_blocks, blocks, polls):
+    old_bytes = 0
+    t0 = time.perf_counter()
+    for i in range(polls):
+        old_bytes += len("".join(html_blocks[:visible_count(len(html_blocks), polls, i)]).encode("utf-8"))
+    old_poll = time.perf_counter() - t0
+    final_html = "".join(html_blocks)
+    t1 = time.perf_counter()
+    old_md = md(final_html, heading_style="ATX").strip()
+    old_convert = time.perf_counter() - t1
+
+    stream = MarkdownStream()
+    new_bytes = 0
+    new_convert = new_poll = 0
+    for i in range(polls):
+        t0 = time.perf_counter()
+        n = visible_count(len(blocks), polls, i)
+        start = min(stream.since, n)
+        snapshot = {"total": n, "start": start, "prefix": sum(stream.sizes[:start]),
+                    "chars": 0, "blocks": blocks[start:n]}
+        new_bytes += len(json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+        t1 = time.perf_counter()
+        new_poll += t1 - t0
+        stream.update(snapshot)
+        new_convert += time.perf_counter() - t1
+    t1 = time.perf_counter()
+    new_md = stream.text()
+    new_convert += time.perf_counter() - t1
+    return {
+        "old": {"poll_ms": round(old_poll * 1000, 2), "transfer_bytes": old_bytes,
+                "convert_ms": round(old_convert * 1000, 2), "md_chars": len(old_md)},
+        "new": {"poll_ms": round(new_poll * 1000, 2), "transfer_bytes": new_bytes,
+                "convert_ms": round(new_convert * 1000, 2), "md_chars": len(new_md)},
+        "same_output": old_md == new_md,
+    }
+
+
+async def bench_browser(html_blocks, polls, headful):
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=not headful)
+        page = await browser.new_page()
+        await page.set_content('<div class="prose"></div>')
+        grow = "(html) => { document.querySelector('.prose').innerHTML = html; }"
+
+        async def run(reader):
+            await page.evaluate(grow, "")
+            spent = 0
+            for i in range(polls):
+                await page.evaluate(grow, "".join(html_blocks[:visible_count(len(html_blocks), polls, i)]))
+                t0 = time.perf_counter()
+                await reader()
+                spent += time.perf_counter() - t0
+            return spent
+
+        old = {"bytes": 0, "html": ""}
+
+        async def old_reader():
+            old["html"] = await page.inner_html(".prose")
+            old["bytes"] += len(old["html"].encode("utf-8"))
+
+        old_poll = await run(old_reader)
+        t0 = time.perf_counter()
+        old_md = md(old["html"], heading_style="ATX").strip()
+        old_convert = time.perf_counter() - t0
+
+        stream = MarkdownStream()
+
+        async def new_reader():
+            await read_answer(page, "perplexity", stream)
+
+        new_poll = await run(new_reader)
+        t0 = time.perf_counter()
+        new_md = stream.text()
+        new_convert = time.perf_counter() - t0
+
+        # Объём одного полного снимка блоками — для сравнения с inner_html
+        full = await page.evaluate(EXTRACT_BLOCKS_JS, {"provider": "perplexity", "since": 0})
+        await browser.close()
+
+    return {
+        "old": {"poll_ms": round(old_poll * 1000, 2), "convert_ms": round(old_convert * 1000, 2),
+                "transfer_bytes": old["bytes"], "md_chars": len(old_md)},
+        "new": {"poll_ms": round(new_poll * 1000, 2), "convert_ms": round(new_convert * 1000, 2),
+                "full_snapshot_bytes": len(json.dumps(full, ensure_ascii=False).encode("utf-8")),
+                "md_chars": len(new_md)},
+        "same_output": old_md == new_md,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Микробенчмарк извлечения ответа агентом")
+    ap.add_argument("--answer-chars", type=int, default=40000)
+    ap.add_argument("--polls", type=int, default=60, help="опросов страницы за генерацию")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--plain", action="store_true", help="только заголовки и абзацы, без списков и кода")
+    ap.add_argument("--browser", action="store_true", help="замер через headless Chromium")
+    ap.add_argument("--headful", action="store_true")
+    ap.add_argument("--out", help="сохранить результат в JSON")
+    args = ap.parse_args()
+
+    html_blocks, blocks = answer_blocks(args.answer_chars, args.seed, rich=not args.plain)
+    if args.browser:
+        result = asyncio.run(bench_browser(html_blocks, args.polls, args.headful))
+    else:
+        result = bench_offline(html_blocks, blocks, args.polls)
+    result["meta"] = {"answer_chars": args.answer_chars, "blocks": len(blocks), "polls": args.polls,
+                      "mode": "browser" if args.browser else "offline"}
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
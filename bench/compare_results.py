@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Сравнение двух прогонов bench/load_server.py или bench/agent_harness.py
+
+Пример:
+    python bench/compare_results.py old.json new.json
+"""
+
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def delta(old, new):
+    if not old: return "   n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Сравнение результатов нагрузочных прогонов")
+    ap.add_argument("old")
+    ap.add_argument("new")
+    args = ap.parse_args()
+
+    with open(args.old, encoding="utf-8") as f: old = json.load(f)
+    with open(args.new, encoding="utf-8") as f: new = json.load(f)
+
+    print(f"{old['meta'].get('git_revision')} → {new['meta'].get('git_revision')}\n")
+    print(f"{'операция':<20}" + "".join(f"{m:>24}" for m in METRICS))
+    for op in sorted(set(old["ops"]) | set(new["ops"])):
+        o, n = old["ops"].get(op), new["ops"].get(op)
+        if not o or not n:
+            print(f"{op:<20}  есть только в {'новом' if n else 'старом'} прогоне")
+            continue
+        cells = "".join(f"{o[m]:>8.1f} → {n[m]:>7.1f} {delta(o[m], n[m])}" for m in METRICS)
+        print(f"{op:<20}{cells}")
+
+    for key in ("throughput_rps", "peak_rss_mb", "chapters_per_min"):
+        o, n = old.get(key), new.get(key)
+        if o is not None and n is not None:
+            print(f"\n{key}: {o} → {n} ({delta(o, n).strip()})", end="")
+    print()
+
+
+if __name__ == "__main__":
+    main()
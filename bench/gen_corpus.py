@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетической database.json для нагрузочных тестов server.py
+
+Пример:
+    python bench/gen_corpus.py --projects 50 --chapters 2000 --out /tmp/bench/database.json
+
+Корпус детерминирован: при одинаковых --seed и размерах получается
+побайтно тот же файл, поэтому результаты разных версий сервера сравнимы.
+"""
+
+import argparse
+import json
+import os
+import random
+
+CJK_CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+RU_WORDS = (
+    "и в не он на я что тот быть с а весь это как она по но они к у ты из мы за вы так же "
+    "от сказать этот который мочь человек о один еще бы такой только себя свое какой когда "
+    "уже для вот кто да говорить год знать мой до или если время рука нет самый ни стать "
+    "большой даже другой наш свой ну под где дело есть сам раз чтобы два там чем глаз жизнь "
+    "первый день ничто потом очень со хотеть ли при голова надо без видеть идти теперь "
+    "тоже стоять друг дом сейчас можно после слово здесь думать место спросить через лицо"
+).split()
+GLOSSARY_SIZE = 200
+
+
+def chapter_original(rnd, chars):
+    """Псевдо-китайский оригинал с абзацами"""
+    paragraphs = []
+    left = chars
+    while left > 0:
+        n = min(left, rnd.randint(60, 240))
+        paragraphs.append("".join(rnd.choices(CJK_CHARS, k=n)) + "。")
+        left -= n
+    return "\n\n".join(paragraphs)
+
+
+def chapter_translation(rnd, chars):
+    """Псевдо-русский перевод примерно заданной длины"""
+    words = []
+    total = 0
+    while total < chars:
+        w = rnd.choice(RU_WORDS)
+        words.append(w)
+        total += len(w) + 1
+    text = " ".join(words)
+    # Абзацы примерно по 400 символов
+    return "\n\n".join(text[i:i + 400] for i in range(0, len(text), 400))
+
+
+def make_glossary(rnd):
+    return [{
+        "original": "".join(rnd.choices(CJK_CHARS, k=rnd.randint(2, 4))),
+        "english-translation": f"Term{i}",
+        "russian-translation": f"Термин{i}",
+        "alt-russian-translation": f"Термин-{i}",
+        "gender": rnd.choice(["masc", "femn", "neut"])
+    } for i in range(GLOSSARY_SIZE)]
+
+
+def make_project(seed, index, chapters, chars, translated_share=0.7):
+    """Один проект; одинаковые аргументы дают одинаковый проект"""
+    rnd = random.Random(f"{seed}:{index}")
+    pid = f"bench-{index:03d}"
+    translated = int(chapters * translated_share)
+    chs = []
+    for n in range(1, chapters + 1):
+        ch = {
+            "id": f"{pid}-ch{n:05d}",
+            "number": n,
+            "title": f"Глава {n}",
+            "original_text": chapter_original(rnd, chars),
+            "status": "completed" if n <= translated else "pending"
+        }
+        if n <= translated:
+            ch["translated_text"] = chapter_translation(rnd, int(chars * 2.2))
+        chs.append(ch)
+    return {
+        "id": pid,
+        "name": f"Синтетический проект {index}",
+        "chapters": chs,
+        "glossary": make_glossary(rnd),
+        "system_prompt": "Переведи текст с китайского на русский, соблюдая глоссарий.",
+        "created_at": "2024-01-01T00:00:00",
+        "rulate_settings": None
+    }
+
+
+def write_corpus(path, projects, chapters, chars, seed=1):
+    """Пишет корпус по одному проекту, не держа всю БД в памяти"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(projects):
+            if i: f.write(",")
+            json.dump(make_project(seed, i, chapters, chars), f, ensure_ascii=False, separators=(",", ":"))
+        f.write("]")
+    return os.path.getsize(path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Генератор синтетической database.json")
+    ap.add_argument("--projects", type=int, default=50)
+    ap.add_argument("--chapters", type=int, default=2000, help="глав в проекте")
+    ap.add_argument("--chars", type=int, default=3000, help="символов в оригинале главы")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="database.json")
+    args = ap.parse_args()
+
+    size = write_corpus(args.out, args.projects, args.chapters, args.chars, args.seed)
+    print(f"✅ {args.out}: {args.projects} проектов × {args.chapters} глав, {size / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
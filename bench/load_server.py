@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон server.py на синтетическом корпусе
+
+Пример:
+    python bench/load_server.py --projects 50 --chapters 2000 --duration 60 --out results.json
+    python bench/compare_results.py old.json results.json
+
+Скрипт:
+  1. генерирует database.json (bench/gen_corpus.py) во временной папке,
+  2. запускает public/server.py через uvicorn на свободном порту,
+  3. гоняет смесь запросов интерфейса и агентов --concurrency клиентами,
+  4. пишет JSON с p50/p95/p99, пропускной способностью и пиковым RSS сервера.
+
+С --url скрипт нагружает уже запущенный сервер (RSS тогда берётся по --pid, если указан).
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(os.path.dirname(BENCH_DIR), "public")
+sys.path.insert(0, BENCH_DIR)
+
+from gen_corpus import write_corpus, make_project, chapter_translation
+
+# Сколько проектов заранее сериализовать для save_project: генерировать
+# их во время нагрузки нельзя, это тормозит сам драйвер
+SAVE_PAYLOADS = 4
+TRANSLATION_POOL = 64
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Доля операций в смеси: дашборд, автосохранение, отправка в перевод,
+# цикл агента (get-job + submit-job), опрос статуса публикации
+DEFAULT_MIX = {
+    "get_projects": 10,
+    "save_project": 5,
+    "send_job": 5,
+    "agent_loop": 50,
+    "publish_status": 30,
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_rss_kb(pid):
+    """(текущий RSS, пиковый RSS) процесса в КБ"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError):
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_info()
+        peak = getattr(info, "peak_wset", info.rss)
+        return info.rss // 1024, peak // 1024
+    except Exception:
+        return 0, 0
+
+
+def percentile(values, q):
+    if not values: return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, op, ms, ok):
+        self.latencies.setdefault(op, []).append(ms)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def report(self):
+        ops = {}
+        for op, values in sorted(self.latencies.items()):
+            ops[op] = {
+                "count": len(values),
+                "errors": self.errors.get(op, 0),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(percentile(values, 0.50), 2),
+                "p95_ms": round(percentile(values, 0.95), 2),
+                "p99_ms": round(percentile(values, 0.99), 2),
+                "max_ms": round(max(values), 2),
+            }
+        return ops
+
+
+async def timed(stats, op, coro):
+    t0 = time.perf_counter()
+    try:
+        res = await coro
+        ok = res.status_code < 400
+    except httpx.HTTPError:
+        res, ok = None, False
+    stats.add(op, (time.perf_counter() - t0) * 1000, ok)
+    return res if ok else None
+
+
+def prepare_payloads(args):
+    """Тела запросов, которые дорого строить на лету"""
+    rnd = random.Random(args.seed)
+    save = {}
+    for pidx in range(min(args.projects, SAVE_PAYLOADS)):
+        project = make_project(args.seed, pidx, args.chapters, args.chars)
+        save[pidx] = json.dumps(project, ensure_ascii=False).encode("utf-8")
+    translations = [chapter_translation(rnd, int(args.chars * 2.2)) for _ in range(TRANSLATION_POOL)]
+    return {"save": save, "translations": translations}
+
+
+async def agent_loop(client, stats, rnd, payloads):
+    res = await timed(stats, "get_job", client.get("/agent-api/get-job"))
+    if res is None: return
+    job = res.json()
+    if job.get("type") != "translate": return
+    results = [{"id": ch["id"], "translated_text": rnd.choice(payloads["translations"])}
+               for ch in job.get("chapters", [])]
+    await timed(stats, "submit_job", client.post("/agent-api/submit-job", json={
+        "type": "translate",
+        "project_id": job.get("pid"),
+        "trace_id": job.get("trace_id"),
+        "results": results
+    }))
+
+
+async def virtual_user(client, stats, rnd, args, mix, payloads, deadline):
+    ops, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        op = rnd.choices(ops, weights)[0]
+        pidx = rnd.randrange(args.projects)
+        pid = f"bench-{pidx:03d}"
+        if op == "get_projects":
+            await timed(stats, op, client.get("/api/projects"))
+        elif op == "save_project":
+            body = payloads["save"][pidx % len(payloads["save"])]
+            await timed(stats, op, client.post("/api/projects/save", content=body, headers=JSON_HEADERS))
+        elif op == "send_job":
+            n = rnd.randint(1, args.chapters)
+            ids = [f"{pid}-ch{i:05d}" for i in range(n, min(n + 5, args.chapters + 1))]
+            await timed(stats, op, client.post("/api/translate/send", json={
+                "project_id": pid, "chapter_ids": ids, "system_prompt": "bench", "batch_size": 5
+            }))
+        elif op == "agent_loop":
+            await agent_loop(client, stats, rnd, payloads)
+        elif op == "publish_status":
+            await timed(stats, op, client.get(f"/api/publish/status/{pid}"))
+
+
+async def sample_rss(pid, peak, stop):
+    while not stop.is_set():
+        rss, hwm = read_rss_kb(pid)
+        peak[0] = max(peak[0], rss, hwm)
+        await asyncio.sleep(0.2)
+
+
+async def run_load(base_url, args, mix, payloads, server_pid):
+    stats = Stats()
+    peak = [0]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server_pid, peak, stop)) if server_pid else None
+    limits = httpx.Limits(max_connections=args.concurrency)
+    # По умолчанию без сжатия: иначе на loopback в замеры попадает распаковка в самом драйвере
+    headers = {"Accept-Encoding": args.accept_encoding}
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits, headers=headers) as client:
+        # Прогрев: первое чтение БД не должно попасть в замеры
+        await client.get("/api/health")
+        await client.get("/api/rulate/settings/warmup")
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            virtual_user(client, stats, random.Random(args.seed * 1000 + i), args, mix, payloads, deadline)
+            for i in range(args.concurrency)
+        ])
+        elapsed = time.monotonic() - started
+    stop.set()
+    if sampler: await sampler
+    return stats, elapsed, peak[0]
+
+
+def wait_ready(url, proc, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server.py завершился с кодом {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/api/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("server.py не поднялся вовремя")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Нагрузочный прогон server.py")
+    ap.add_argument("--projects", type=int, default=50)
+    ap.add_argument("--chapters", type=int, default=2000)
+    ap.add_argument("--chars", type=int, default=3000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--duration", type=float, default=60, help="секунд нагрузки")
+    ap.add_argument("--concurrency", type=int, default=16, help="одновременных клиентов")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--accept-encoding", default="identity", help="например gzip или zstd, чтобы мерить сжатые ответы")
+    ap.add_argument("--mix", help='веса операций в JSON, например \'{"agent_loop": 1}\'')
+    ap.add_argument("--url", help="нагружать уже запущенный сервер")
+    ap.add_argument("--pid", type=int, help="PID сервера для замера RSS при --url")
+    ap.add_argument("--workdir", help="папка для database.json (по умолчанию временная)")
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args()
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = {k: v for k, v in json.loads(args.mix).items() if k in DEFAULT_MIX and v > 0}
+
+    proc = None
+    corpus_mb = None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cw-bench-")
+    try:
+        if args.url:
+            base_url, server_pid = args.url.rstrip("/"), args.pid
+        else:
+            db_path = os.path.join(workdir, "database.json")
+            print(f"📦 Генерация корпуса: {args.projects} × {args.chapters} глав...")
+            corpus_mb = round(write_corpus(db_path, args.projects, args.chapters, args.chars, args.seed) / 1024 / 1024, 1)
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            env = dict(os.environ, PYTHONPATH=SERVER_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                 "--port", str(port), "--log-level", "warning"],
+                cwd=workdir, env=env
+            )
+            server_pid = proc.pid
+            wait_ready(base_url, proc)
+
+        payloads = prepare_payloads(args)
+        print(f"🚀 Нагрузка {args.duration:.0f}с, {args.concurrency} клиентов → {base_url}")
+        stats, elapsed, peak_kb = asyncio.run(run_load(base_url, args, mix, payloads, server_pid))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    ops = stats.report()
+    total = sum(o["count"] for o in ops.values())
+    result = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "projects": args.projects,
+            "chapters": args.chapters,
+            "chars": args.chars,
+            "seed": args.seed,
+            "corpus_mb": corpus_mb,
+            "concurrency": args.concurrency,
+            "duration_s": round(elapsed, 2),
+            "mix": mix,
+            "accept_encoding": args.accept_encoding,
+        },
+        "total_requests": total,
+        "total_errors": sum(o["errors"] for o in ops.values()),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+        "peak_rss_mb": round(peak_kb / 1024, 1) if peak_kb else None,
+        "ops": ops,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'операция':<16}{'n':>8}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for op, o in ops.items():
+        print(f"{op:<16}{o['count']:>8}{o['errors']:>6}{o['p50_ms']:>10.1f}{o['p95_ms']:>10.1f}{o['p99_ms']:>10.1f}")
+    print(f"\n⚡ {result['throughput_rps']} запросов/с, пиковый RSS: {result['peak_rss_mb']} МБ")
+    print(f"💾 Результаты: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Локальные заглушки Perplexity, Google AI Studio и Rulate для прогонов агентов без интернета
+
+Пример:
+    python bench/mock_sites.py --port 8765 --latency 1.5 --answer-chars 6000 --fail-rate 0.05
+
+Страницы повторяют только ту разметку, на которую опираются
+perplexity_worker / aistudio_worker (inlands_bridge.py),
+translate_worker / publish_chapter (local_bridge_agent.py):
+
+    /perplexity/     #ask-input, кнопка Submit, ответ потоком в .prose
+    /aistudio/       textarea.textarea, кнопка Run, ms-chat-turn / ms-prompt-chunk
+    /rulate/book/N   "Добавить главы" → "Одну главу" → форма → импорт → "как перевод"
+
+Ответ идёт потоком с /mock/stream: задержка до первого токена (--latency),
+пауза между порциями (--chunk-delay), длина (--answer-chars).
+--fail-rate задаёт долю сбоев: обрыв потока, пустой ответ или HTTP 500.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+RU_WORDS = (
+    "он она сказал тихо вдруг мастер секта клинок небо земля сила ученик старейшина "
+    "путь культивация меч ци дракон гора долина тайна голос взгляд шаг рука свет тень "
+    "время ночь утро ветер огонь вода камень дверь двор зал храм враг друг брат сестра"
+).split()
+FAILURE_MODES = ("abort", "empty", "http500")
+END_MARKER = "===КОНЕЦ==="
+
+
+class MockConfig:
+    def __init__(self, latency=1.0, chunk_delay=0.05, chunk_words=12, answer_chars=4000,
+                 fail_rate=0.0, end_marker=True, seed=None):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.answer_chars = answer_chars
+        self.fail_rate = fail_rate
+        self.end_marker = end_marker
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"streams": 0, "failures": {m: 0 for m in FAILURE_MODES}, "published": []}
+
+    def pick_failure(self):
+        with self.lock:
+            if self.rnd.random() < self.fail_rate:
+                mode = self.rnd.choice(FAILURE_MODES)
+                self.stats["failures"][mode] += 1
+                return mode
+        return None
+
+    def answer_text(self):
+        """Ответ в упрощённом markdown: ## заголовок, абзацы, *курсив*"""
+        with self.lock:
+            rnd = random.Random(self.rnd.random())
+        parts = [f"## Глава {rnd.randint(1, 999)}"]
+        total = 0
+        while total < self.answer_chars:
+            words = [rnd.choice(RU_WORDS) for _ in range(rnd.randint(25, 70))]
+            words[rnd.randrange(len(words))] = f"*{rnd.choice(RU_WORDS)}*"
+            para = " ".join(words).capitalize() + "."
+            parts.append(para)
+            total += len(para)
+        return "\n\n".join(parts)
+
+
+# Общий для заглушек рендер потока: текст → блоки <h2>/<p>/<em>, как у настоящих сайтов
+STREAM_JS = r"""
+function renderMarkdown(text) {
+  return text.split('\n\n').filter(Boolean).map(block => {
+    const inline = block.replace(/\*([^*]+)\*/g, '<em>$1</em>');
+    return block.startsWith('## ') ? `<h2>${inline.slice(3)}</h2>` : `<p>${inline}</p>`;
+  }).join('');
+}
+async function streamAnswer(provider, onText) {
+  const res = await fetch(`/mock/stream?provider=${provider}`);
+  if (!res.ok) { onText(''); return; }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let text = '';
+  while (true) {
+    const {done, value} = await reader.read();
+    if (done) break;
+    text += decoder.decode(value, {stream: true});
+    onText(text);
+  }
+}
+"""
+
+PERPLEXITY_PAGE = """<!doctype html><html><head><meta charset="utf-8"><title>Perplexity (mock)</title>
+<style>.prose { min-height: 1em; }</style></head>
+<body>
+<div class="relative flex">
+  <button aria-label="Gemini 3 Pro">Gemini 3 Pro</button>
+  <button aria-label="Источники" id="sources">Источники</button>
+  <div id="sources-menu" style="display:none">
+    <div role="menuitemcheckbox">Веб <button role="switch" data-state="checked" id="web-switch">on</button></div>
+  </div>
+  <div id="thread"></div>
+  <textarea id="ask-input" rows="4" cols="80"></textarea>
+  <button aria-label="Submit" id="submit">↑</button>
+</div>
+<script>
+%(stream_js)s
+const input = document.getElementById('ask-input');
+document.getElementById('sources').onclick = (e) => {
+  e.stopPropagation();
+  document.getElementById('sources-menu').style.display = 'block';
+};
+document.getElementById('web-switch').onclick = (e) => {
+  e.stopPropagation();
+  const sw = e.target;
+  sw.dataset.state = sw.dataset.state === 'checked' ? 'unchecked' : 'checked';
+};
+document.addEventListener('click', () => {
+  document.getElementById('sources-menu').style.display = 'none';
+});
+function ask() {
+  if (!input.value.trim()) return;
+  input.value = '';
+  const prose = document.createElement('div');
+  prose.className = 'prose';
+  prose.textContent = '…';
+  document.getElementById('thread').appendChild(prose);
+  streamAnswer('perplexity', text => { prose.innerHTML = renderMarkdown(text); });
+}
+document.getElementById('submit').onclick = ask;
+input.addEventListener('keydown', e => {
+  if (e.key === 'Enter' && !e.shiftKey) { e.preventDefault(); ask(); }
+});
+</script>
+</body></html>"""
+
+AISTUDIO_PAGE = r"""<!doctype html><html><head><meta charset="utf-8"><title>AI Studio (mock)</title></head>
+<body>
+<ms-autoscroll-container style="display:block;height:400px;overflow:auto"></ms-autoscroll-container>
+<textarea class="textarea" rows="4" cols="80"></textarea>
+<button aria-label="Run" class="run-button">Run</button>
+<script>
+%(stream_js)s
+const container = document.querySelector('ms-autoscroll-container');
+const input = document.querySelector('textarea');
+function run() {
+  if (!input.value.trim()) return;
+  const userTurn = document.createElement('ms-chat-turn');
+  userTurn.innerHTML = '<div data-turn-role="User"><div class="turn-content"></div></div>';
+  userTurn.querySelector('.turn-content').textContent = input.value.slice(0, 200);
+  container.appendChild(userTurn);
+  input.value = '';
+  const modelTurn = document.createElement('ms-chat-turn');
+  modelTurn.setAttribute('data-turn-role', 'Model');
+  modelTurn.innerHTML = '<div class="turn-content"></div>';
+  container.appendChild(modelTurn);
+  const content = modelTurn.querySelector('.turn-content');
+  streamAnswer('aistudio', text => {
+    // AI Studio рендерит ответ несколькими ms-prompt-chunk
+    const blocks = text.split('\n\n').filter(Boolean);
+    const chunks = [];
+    for (let i = 0; i < blocks.length; i += 4) chunks.push(blocks.slice(i, i + 4).join('\n\n'));
+    content.innerHTML = chunks.map(c => `<ms-prompt-chunk>${renderMarkdown(c)}</ms-prompt-chunk>`).join('');
+  });
+}
+document.querySelector('.run-button').onclick = run;
+input.addEventListener('keydown', e => { if (e.key === 'Enter' && e.ctrlKey) run(); });
+</script>
+</body></html>"""
+
+RULATE_BOOK = """<!doctype html><html><head><meta charset="utf-8"><title>Книга %(book)s</title></head>
+<body>
+<h1>Книга %(book)s</h1>
+<a href="#" id="add" onclick="document.getElementById('add-menu').style.display='block';return false;">Добавить главы</a>
+<div id="add-menu" style="display:none"><a href="/rulate/book/%(book)s/new">Одну главу</a></div>
+</body></html>"""
+
+RULATE_NEW = """<!doctype html><html><head><meta charset="utf-8"><title>Новая глава</title></head>
+<body>
+<form method="post" action="/rulate/book/%(book)s/new">
+  <input name="title" id="title" placeholder="Введите название">
+  <select name="status" id="status"><option value="0">Черновик</option><option value="1">Готов</option></select>
+  <label><input type="checkbox" name="delayed" id="delayed"> Отложенная глава</label>
+  <label><input type="checkbox" name="subscription"> Только по подписке</label>
+  <button type="submit">Сохранить</button>
+</form>
+</body></html>"""
+
+RULATE_CHAPTER = """<!doctype html><html><head><meta charset="utf-8"><title>Глава</title></head>
+<body>
+<h1>%(title)s</h1>
+<a href="/rulate/book/%(book)s/%(cid)s/import">импортировать текст</a>
+</body></html>"""
+
+RULATE_IMPORT = """<!doctype html><html><head><meta charset="utf-8"><title>Импорт</title></head>
+<body>
+<form method="post" action="/rulate/book/%(book)s/%(cid)s/import">
+  <textarea name="text" rows="10" cols="80"></textarea>
+  <button type="submit">Далее</button>
+</form>
+</body></html>"""
+
+RULATE_CONFIRM = """<!doctype html><html><head><meta charset="utf-8"><title>Импорт</title></head>
+<body>
+<form method="post" action="/rulate/book/%(book)s/%(cid)s/confirm">
+  <label><input type="checkbox" name="as_translation"> Добавить как перевод</label>
+  <button type="submit">Сохранить</button>
+</form>
+</body></html>"""
+
+
+def make_handler(config):
+    chapters = {}
+    next_id = [1000]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_html(self, html, status=200):
+            body = html.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, data, status=200):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def redirect(self, location):
+            self.send_response(303)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def read_form(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode("utf-8") if length else ""
+            return {k: v[0] for k, v in parse_qs(raw, keep_blank_values=True).items()}
+
+        def stream_answer(self):
+            failure = config.pick_failure()
+            if failure == "http500":
+                return self.send_json({"error": "mock failure"}, 500)
+            with config.lock:
+                config.stats["streams"] += 1
+            text = "" if failure == "empty" else config.answer_text()
+            if config.end_marker and failure is None and "aistudio" in self.path:
+                text += f"\n\n{END_MARKER}"
+            words = re.split(r"(?<= )", text)
+            if failure == "abort":
+                words = words[:len(words) // 3]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(config.latency)
+            try:
+                for i in range(0, len(words), config.chunk_words):
+                    chunk = "".join(words[i:i + config.chunk_words]).encode("utf-8")
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(config.chunk_delay)
+                if failure == "abort":
+                    # Обрыв: закрываем соединение без завершающего чанка, клиент видит незаконченный ответ
+                    self.close_connection = True
+                    return
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            parts = path.strip("/").split("/")
+            if path.startswith("/perplexity"):
+                return self.send_html(PERPLEXITY_PAGE % {"stream_js": STREAM_JS})
+            if path.startswith("/aistudio"):
+                return self.send_html(AISTUDIO_PAGE % {"stream_js": STREAM_JS})
+            if path == "/mock/stream":
+                return self.stream_answer()
+            if path == "/mock/stats":
+                with config.lock:
+                    return self.send_json(config.stats)
+            if parts[:2] == ["rulate", "book"] and len(parts) >= 3:
+                book = parts[2]
+                if len(parts) == 3:
+                    return self.send_html(RULATE_BOOK % {"book": book})
+                if parts[3] == "new":
+                    return self.send_html(RULATE_NEW % {"book": book})
+                cid = parts[3]
+                ch = chapters.get(cid)
+                if not ch:
+                    return self.send_html("<h1>404</h1>", 404)
+                page = {"import": RULATE_IMPORT, "confirm": RULATE_CONFIRM}.get(parts[4] if len(parts) > 4 else "", RULATE_CHAPTER)
+                return self.send_html(page % {"book": book, "cid": cid, "title": ch["title"]})
+            self.send_html("<h1>404</h1>", 404)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            parts = path.strip("/").split("/")
+            form = self.read_form()
+            # inlands_bridge шлёт логи на SERVER_URL/api/agent/log
+            if path == "/api/agent/log":
+                return self.send_json({"status": "ok"})
+            if parts[:2] == ["rulate", "book"] and len(parts) >= 4:
+                book = parts[2]
+                if parts[3] == "new":
+                    if config.pick_failure():
+                        return self.send_html("<h1>Ошибка сервера</h1>", 500)
+                    with config.lock:
+                        next_id[0] += 1
+                        cid = str(next_id[0])
+                    chapters[cid] = {"title": form.get("title", ""), "status": form.get("status"),
+                                     "delayed": "delayed" in form, "subscription": "subscription" in form}
+                    return self.redirect(f"/rulate/book/{book}/{cid}")
+                cid = parts[3]
+                ch = chapters.get(cid)
+                if not ch:
+                    return self.send_html("<h1>404</h1>", 404)
+                if parts[4:] == ["import"]:
+                    ch["text"] = form.get("text", "")
+                    return self.redirect(f"/rulate/book/{book}/{cid}/confirm")
+                if parts[4:] == ["confirm"]:
+                    ch["as_translation"] = "as_translation" in form
+                    with config.lock:
+                        config.stats["published"].append({"id": cid, "title": ch["title"], "chars": len(ch.get("text", ""))})
+                    return self.redirect(f"/rulate/book/{book}/{cid}")
+            self.send_html("<h1>404</h1>", 404)
+
+    return Handler
+
+
+def start_mock_server(config, host="127.0.0.1", port=0):
+    """Запускает заглушки в фоновом потоке; возвращает (сервер, базовый URL)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Заглушки Perplexity / AI Studio / Rulate")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=1.0, help="секунд до первого токена")
+    ap.add_argument("--chunk-delay", type=float, default=0.05, help="секунд между порциями")
+    ap.add_argument("--answer-chars", type=int, default=4000)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args()
+
+    config = MockConfig(latency=args.latency, chunk_delay=args.chunk_delay, answer_chars=args.answer_chars,
+                        fail_rate=args.fail_rate, seed=args.seed)
+    server, url = start_mock_server(config, port=args.port)
+    print(f"🧪 Заглушки запущены: {url}/perplexity/  {url}/aistudio/  {url}/rulate/book/1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
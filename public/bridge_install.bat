@@ -23,10 +23,6 @@ echo.
 echo [INFO] Устанавливаем playwright...
 pip install playwright
 
-echo.
-echo [INFO] Устанавливаем markdownify...
-pip install markdownify
-
 echo.
 echo [INFO] Устанавливаем Chromium для Playwright...
 playwright install chromium
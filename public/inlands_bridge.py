@@ -42,16 +42,17 @@ import time
 import re
 import os
 import sys
+import uuid
+from contextlib import contextmanager
 
 # --- БЛОК БЕЗОПАСНОГО ИМПОРТА ---
 try:
     import httpx
     from playwright.async_api import async_playwright
-    from markdownify import markdownify as md
 except ImportError as e:
     print(f"\n❌ ОШИБКА: Не установлена библиотека {e.name}")
     print("Выполните команду установки в терминале:")
-    print("pip install httpx playwright markdownify && playwright install chromium")
+    print("pip install httpx playwright && playwright install chromium")
     input("\nНажмите Enter, чтобы выйти...")
     sys.exit(1)
 
@@ -66,6 +67,8 @@ AISTUDIO_URL = "https://aistudio.google.com/prompts/new_chat"
 
 # КОЛИЧЕСТВО ОДНОВРЕМЕННЫХ ВКЛАДОК (ЗАДАЧ)
 MAX_CONCURRENT_JOBS = 3
+AGENT_NAME = "inlands_bridge"
+END_MARKER = "===КОНЕЦ==="
 
 
 async def send_log(job_id, message, log_type="info", details=None):
@@ -87,6 +90,216 @@ async def send_log(job_id, message, log_type="info", details=None):
     print(f"[{job_id[:8] if job_id else 'SYSTEM'}] {message}")
 
 
+def record_span(spans, stage, start, duration_ms, **meta):
+    """Добавляет спан этапа задачи (уходит на сервер вместе с результатом)"""
+    spans.append({
+        "stage": stage,
+        "agent": AGENT_NAME,
+        "start": start,
+        "duration_ms": round(duration_ms, 1),
+        "meta": meta
+    })
+
+
+def span_mark():
+    """Отметка начала этапа: (время по часам, монотонное время)"""
+    return time.time(), time.perf_counter()
+
+
+def close_span(spans, stage, mark, **meta):
+    """Закрывает этап, начатый в span_mark()"""
+    record_span(spans, stage, mark[0], (time.perf_counter() - mark[1]) * 1000, **meta)
+
+
+@contextmanager
+def trace_span(spans, stage, **meta):
+    """Замеряет этап задачи"""
+    mark = span_mark()
+    try:
+        yield meta
+    finally:
+        close_span(spans, stage, mark, **meta)
+
+
+# --- ИЗВЛЕЧЕНИЕ ОТВЕТА ---
+# Ответ разбирается прямо на странице в компактные блоки:
+#   {k: "h"|"p"|"li"|"q"|"pre"|"hr", l: уровень/номер, d: вложенность, r: [[текст, флаги], ...]}
+# флаги: 1 — жирный, 2 — курсив, 4 — код, -1 — перенос строки.
+# Через CDP передаются только блоки начиная с since: готовые блоки повторно не гоняются.
+# prefix — число символов в блоках до since, по нему видно, что страница перерисовала начало.
+EXTRACT_BLOCKS_JS = '''({provider, since}) => {
+    let roots = [];
+    if (provider === "perplexity") {
+        const all = document.querySelectorAll(".prose");
+        if (all.length) roots = [all[all.length - 1]];
+    } else {
+        const chatContainer = document.querySelector("ms-autoscroll-container");
+        if (chatContainer) chatContainer.scrollTop = chatContainer.scrollHeight;
+        let modelTurn = document.querySelector("ms-autoscroll-container ms-chat-turn:last-of-type");
+        if (!modelTurn || modelTurn.querySelector('[data-turn-role="User"]')) {
+            const turns = document.querySelectorAll('ms-chat-turn[data-turn-role="Model"]');
+            modelTurn = turns.length ? turns[turns.length - 1] : null;
+        }
+        if (modelTurn) {
+            const chunks = Array.from(modelTurn.querySelectorAll("ms-prompt-chunk"));
+            const turnContent = modelTurn.querySelector(".turn-content");
+            roots = chunks.length ? chunks : (turnContent ? [turnContent] : []);
+        }
+    }
+    const BLOCK = /^(P|H[1-6]|BLOCKQUOTE|PRE|HR|UL|OL|TABLE)$/;
+    const WRAPPER = /^(DIV|SECTION|ARTICLE|MAIN)$|-/;
+    const blocks = [];
+    let loose = null;
+    const size = (runs) => runs.reduce((n, r) => n + r[0].length, 0);
+    const inline = (node, flags, runs, skipLists) => {
+        if (node.nodeType === 3) { runs.push([node.nodeValue, flags]); return; }
+        if (node.nodeType !== 1) return;
+        const tag = node.tagName;
+        if (tag === "BR") { runs.push(["\\n", -1]); return; }
+        if (skipLists && (tag === "UL" || tag === "OL")) return;
+        let f = flags;
+        if (tag === "STRONG" || tag === "B") f |= 1;
+        if (tag === "EM" || tag === "I") f |= 2;
+        if (tag === "CODE") f |= 4;
+        for (const child of node.childNodes) inline(child, f, runs, skipLists);
+    };
+    const flushLoose = () => {
+        if (loose && loose.some(r => r[0].trim())) blocks.push({k: "p", r: loose});
+        loose = null;
+    };
+    const list = (el, depth, indent) => {
+        let n = 0;
+        for (const li of el.children) {
+            if (li.tagName !== "LI") continue;
+            n += 1;
+            const runs = [];
+            inline(li, 0, runs, true);
+            const num = el.tagName === "OL" ? n : 0;
+            blocks.push({k: "li", l: num, d: depth, w: indent, s: n === 1 && depth === 0, r: runs});
+            // Вложенный список отступает на ширину маркера родителя, как в markdownify
+            const width = num ? String(num).length + 2 : 2;
+            for (const sub of li.children) {
+                if (sub.tagName === "UL" || sub.tagName === "OL") list(sub, depth + 1, indent + width);
+            }
+        }
+    };
+    const block = (el) => {
+        const tag = el.tagName;
+        if (/^H[1-6]$/.test(tag)) { const runs = []; inline(el, 0, runs); blocks.push({k: "h", l: +tag[1], r: runs}); }
+        else if (tag === "P") { const runs = []; inline(el, 0, runs); blocks.push({k: "p", r: runs}); }
+        else if (tag === "BLOCKQUOTE") { const runs = []; inline(el, 0, runs); blocks.push({k: "q", r: runs}); }
+        else if (tag === "PRE") blocks.push({k: "pre", r: [[el.textContent, 4]]});
+        else if (tag === "HR") blocks.push({k: "hr", r: []});
+        else if (tag === "UL" || tag === "OL") list(el, 0, 0);
+        else blocks.push({k: "p", r: [[el.innerText, 0]]});
+    };
+    const walk = (el) => {
+        for (const node of el.childNodes) {
+            if (node.nodeType === 1 && BLOCK.test(node.tagName)) { flushLoose(); block(node); }
+            else if (node.nodeType === 1 && WRAPPER.test(node.tagName)) { flushLoose(); walk(node); }
+            else { loose = loose || []; inline(node, 0, loose); }
+        }
+        flushLoose();
+    };
+    roots.forEach(walk);
+    const start = Math.max(0, Math.min(since, blocks.length));
+    let prefix = 0, chars = 0;
+    blocks.forEach((b, i) => { const n = size(b.r); chars += n; if (i < start) prefix += n; });
+    return {total: blocks.length, start, prefix, chars, blocks: blocks.slice(start)};
+}'''
+
+MD_ESCAPE_RE = re.compile(r"([*_])")
+SPACES_RE = re.compile(r"\s+")
+LINE_BREAK = "\x00"
+LINE_BREAK_RE = re.compile(r" *\x00 *")
+LIST_BULLETS = "*+-"   # по уровню вложенности, как у markdownify
+
+
+def runs_to_markdown(runs):
+    """Инлайн-разметка блока: **жирный**, *курсив*, `код`, переносы строк"""
+    out = []
+    for text, flags in runs:
+        if flags == -1:
+            out.append(LINE_BREAK)
+            continue
+        text = SPACES_RE.sub(" ", text)
+        if not flags or not text.strip():
+            out.append(MD_ESCAPE_RE.sub(r"\\\1", text) if not flags & 4 else text)
+            continue
+        core = text.strip() if flags & 4 else MD_ESCAPE_RE.sub(r"\\\1", text.strip())
+        if flags & 4: core = f"`{core}`"
+        if flags & 2: core = f"*{core}*"
+        if flags & 1: core = f"**{core}**"
+        lead = " " if text[0].isspace() else ""
+        tail = " " if text[-1].isspace() else ""
+        out.append(lead + core + tail)
+    md_text = "".join(out)
+    # Соседние куски одного стиля: **a** **b** → **a b**
+    md_text = md_text.replace("** **", " ").replace("****", "")
+    return LINE_BREAK_RE.sub("  \n", md_text.strip(" " + LINE_BREAK))
+
+
+def block_to_markdown(block):
+    kind = block.get("k")
+    if kind == "hr": return "---"
+    if kind == "pre": return "```\n" + "".join(r[0] for r in block["r"]).strip("\n") + "\n```"
+    text = runs_to_markdown(block["r"])
+    if not text: return ""
+    if kind == "h": return "#" * block.get("l", 1) + " " + text
+    if kind == "q": return "\n".join("> " + line for line in text.split("\n"))
+    if kind == "li":
+        depth = block.get("d", 0)
+        bullet = f"{block['l']}. " if block.get("l") else LIST_BULLETS[depth % len(LIST_BULLETS)] + " "
+        return " " * block.get("w", 2 * depth) + bullet + text
+    return text
+
+
+class MarkdownStream:
+    """Markdown ответа, собираемый по мере генерации.
+    Готовые блоки конвертируются один раз, последний — на каждом опросе."""
+
+    def __init__(self):
+        self.parts = []
+        self.kinds = []   # "li+" — первый пункт нового списка
+        self.sizes = []
+        self.total_chars = 0
+
+    @property
+    def since(self):
+        # Последний блок ещё может дописываться
+        return max(0, len(self.parts) - 1)
+
+    def update(self, snapshot):
+        start = snapshot["start"]
+        del self.parts[start:], self.kinds[start:], self.sizes[start:]
+        for block in snapshot["blocks"]:
+            self.parts.append(block_to_markdown(block))
+            self.kinds.append("li+" if block.get("s") else block.get("k"))
+            self.sizes.append(sum(len(r[0]) for r in block["r"]))
+        self.total_chars = snapshot["chars"]
+
+    def tail(self, n=3):
+        return "\n\n".join(self.parts[-n:])
+
+    def text(self):
+        out = []
+        for kind, prev, part in zip(self.kinds, [None] + self.kinds, self.parts):
+            if not part: continue
+            if out: out.append("\n" if kind == "li" and prev in ("li", "li+") else "\n\n")
+            out.append(part)
+        return "".join(out).strip()
+
+
+async def read_answer(page, provider, stream):
+    """Дочитывает новые блоки ответа в stream; возвращает число символов ответа"""
+    snapshot = await page.evaluate(EXTRACT_BLOCKS_JS, {"provider": provider, "since": stream.since})
+    if snapshot["prefix"] != sum(stream.sizes[:snapshot["start"]]):
+        # Страница перерисовала уже прочитанные блоки — перечитываем целиком
+        snapshot = await page.evaluate(EXTRACT_BLOCKS_JS, {"provider": provider, "since": 0})
+    stream.update(snapshot)
+    return stream.total_chars
+
+
 def get_web_socket_debugger_url():
     """Получает URL отладчика браузера"""
     try:
@@ -108,15 +321,17 @@ async def create_page_safe(context):
         return None
 
 
-async def perplexity_worker(context, full_prompt, task_id):
+async def perplexity_worker(context, full_prompt, task_id, spans):
     """Воркер для Perplexity AI"""
     await send_log(task_id, "🟢 [Perplexity] Запускаю браузер...", "info")
-    page = await create_page_safe(context)
+    with trace_span(spans, "page_create"):
+        page = await create_page_safe(context)
     if not page:
         await send_log(task_id, "❌ Не удалось создать страницу в браузере.", "error")
         return None
     
     try:
+        mark = span_mark()
         await page.goto(PERPLEXITY_URL)
         try:
             await page.wait_for_selector("div.relative.flex", timeout=15000)
@@ -145,9 +360,11 @@ async def perplexity_worker(context, full_prompt, task_id):
                 if await web_switch.get_attribute("data-state") == "checked":
                     await web_switch.click()
             await page.mouse.click(0, 0)
+        close_span(spans, "page_setup", mark)
 
         # Ввод промпта
         await send_log(task_id, f"✍️ Вставляю текст ({len(full_prompt)} символов)...", "info")
+        mark = span_mark()
         await page.click("#ask-input")
         await page.fill("#ask-input", full_prompt)
         await page.wait_for_timeout(300)
@@ -159,25 +376,33 @@ async def perplexity_worker(context, full_prompt, task_id):
             await submit_btn.click()
         else:
             await page.keyboard.press("Enter")
+        close_span(spans, "prompt_entry", mark, chars=len(full_prompt))
 
         # Ожидание ответа
         await send_log(task_id, "⏳ Генерация ответа (может занять время)...", "warning")
+        mark = span_mark()
         answer_locator = page.locator(".prose").last
         await answer_locator.wait_for(state="visible", timeout=600000)
         
         prev_len = 0
-        html_content = ""
+        stream = MarkdownStream()
         stability_counter = 0
         REQUIRED_STABILITY = 6
+        extract_start = time.time()
+        extract_ms = 0
+        polls = 0
         
         for i in range(600):
             await page.wait_for_timeout(2000)
+            t0 = time.perf_counter()
             try:
-                html_content = await answer_locator.inner_html()
+                curr_len = await read_answer(page, "perplexity", stream)
             except:
                 continue
+            finally:
+                extract_ms += (time.perf_counter() - t0) * 1000
+                polls += 1
             
-            curr_len = len(html_content)
             if i % 15 == 0 and curr_len > 0:
                 print(f"[{task_id[:8]}] ... {curr_len} символов")
             
@@ -190,8 +415,11 @@ async def perplexity_worker(context, full_prompt, task_id):
                 await send_log(task_id, "✅ Генерация стабильна и завершена.", "success")
                 break
             prev_len = curr_len
+        close_span(spans, "generation", mark)
+        record_span(spans, "html_extraction", extract_start, extract_ms, polls=polls, chars=stream.total_chars)
 
-        markdown_text = md(html_content, heading_style="ATX").strip()
+        with trace_span(spans, "markdown_conversion", chars=stream.total_chars):
+            markdown_text = stream.text()
         return markdown_text
 
     except Exception as e:
@@ -202,15 +430,17 @@ async def perplexity_worker(context, full_prompt, task_id):
             await page.close()
 
 
-async def aistudio_worker(context, full_prompt, task_id):
+async def aistudio_worker(context, full_prompt, task_id, spans):
     """Воркер для Google AI Studio"""
     await send_log(task_id, "🔵 [AI Studio] Запуск...", "info")
-    page = await create_page_safe(context)
+    with trace_span(spans, "page_create"):
+        page = await create_page_safe(context)
     if not page:
         await send_log(task_id, "❌ Не удалось создать страницу.", "error")
         return None
     
     try:
+        mark = span_mark()
         await page.goto(AISTUDIO_URL, wait_until="domcontentloaded", timeout=60000)
         
         try:
@@ -220,8 +450,10 @@ async def aistudio_worker(context, full_prompt, task_id):
             return None
         
         await page.wait_for_timeout(1500)
+        close_span(spans, "page_setup", mark)
         
         await send_log(task_id, f"✍️ Вставка промпта...", "info")
+        mark = span_mark()
         await page.evaluate('''(text) => {
             const el = document.querySelector('textarea.textarea') || document.querySelector('textarea');
             if(el) {
@@ -240,50 +472,34 @@ async def aistudio_worker(context, full_prompt, task_id):
             await send_log(task_id, "🚀 Run нажат...", "info")
         else:
             await page.locator("textarea").press("Control+Enter")
+        close_span(spans, "prompt_entry", mark, chars=len(full_prompt))
             
         await send_log(task_id, "⏳ Ожидание ответа...", "warning")
+        mark = span_mark()
         await page.wait_for_timeout(3000)
         
         prev_len = 0
         stability_counter = 0
         REQUIRED_STABILITY = 15
-        current_html = ""
+        stream = MarkdownStream()
+        extract_start = time.time()
+        extract_ms = 0
+        polls = 0
         
         for i in range(1200):
             await page.wait_for_timeout(2000)
             
-            current_html = await page.evaluate('''() => {
-                const chatContainer = document.querySelector('ms-autoscroll-container');
-                if (chatContainer) chatContainer.scrollTop = chatContainer.scrollHeight;
-                
-                let modelTurn = document.querySelector('ms-autoscroll-container ms-chat-turn:last-of-type');
-                if (!modelTurn || modelTurn.querySelector('[data-turn-role="User"]')) {
-                    const allModelTurns = Array.from(document.querySelectorAll('ms-chat-turn[data-turn-role="Model"]'));
-                    if (allModelTurns.length > 0) modelTurn = allModelTurns[allModelTurns.length - 1];
-                    else return "";
-                }
-                
-                let fullHtml = "";
-                let responseChunks = Array.from(modelTurn.querySelectorAll('ms-prompt-chunk'));
-                
-                if (responseChunks.length === 0) {
-                    const turnContent = modelTurn.querySelector('.turn-content');
-                    if (turnContent) fullHtml = turnContent.innerHTML;
-                } else {
-                    fullHtml = responseChunks.map(chunk => chunk.innerHTML).join('');
-                }
-                
-                return fullHtml;
-            }''')
-            
-            curr_len = len(current_html)
+            t0 = time.perf_counter()
+            curr_len = await read_answer(page, "aistudio", stream)
+            extract_ms += (time.perf_counter() - t0) * 1000
+            polls += 1
             
             if curr_len > 100 and curr_len == prev_len:
                 stability_counter += 1
             elif curr_len != prev_len:
                 stability_counter = 0
             
-            if "===КОНЕЦ===" in current_html:
+            if END_MARKER in stream.tail():
                 if stability_counter >= 2:
                     await send_log(task_id, "✅ Маркер завершения найден.", "success")
                     break
@@ -292,11 +508,11 @@ async def aistudio_worker(context, full_prompt, task_id):
                 break
                 
             prev_len = curr_len
+        close_span(spans, "generation", mark)
+        record_span(spans, "html_extraction", extract_start, extract_ms, polls=polls, chars=stream.total_chars)
         
-        if current_html:
-            final_text = md(current_html, heading_style="ATX").strip()
-        else:
-            final_text = ""
+        with trace_span(spans, "markdown_conversion", chars=stream.total_chars):
+            final_text = stream.text()
 
         return final_text
         
@@ -324,11 +540,11 @@ async def get_job_from_server():
     return None
 
 
-async def submit_job_to_server(job_id, results=None, error_message=None):
+async def submit_job_to_server(job_id, results=None, error_message=None, trace_id=None, spans=None):
     """Отправляет результат на сервер"""
     url = f"{SERVER_URL}/api/agent/submit-job"
     headers = {"X-Agent-API-Key": AGENT_API_KEY}
-    payload = {"job_id": job_id}
+    payload = {"job_id": job_id, "trace_id": trace_id, "spans": spans or []}
     
     if error_message:
         payload["error_message"] = error_message
@@ -345,27 +561,29 @@ async def submit_job_to_server(job_id, results=None, error_message=None):
         print(f"[{job_id[:8]}] ❌ Не удалось отправить результат: {e}")
 
 
-async def process_job(context, job):
+async def process_job(context, job, spans):
     """Обрабатывает одну задачу"""
     job_id = job["job_id"]
     provider = job.get("provider", "perplexity")
     prompt = job.get("prompt", "")
+    # API InLands trace_id не выдаёт — тогда трассу начинает сам агент
+    trace_id = job.get("trace_id") or uuid.uuid4().hex
     
     await send_log(job_id, f"📋 Получена задача: {provider}", "info")
     
     if provider == "perplexity":
-        result = await perplexity_worker(context, prompt, job_id)
+        result = await perplexity_worker(context, prompt, job_id, spans)
     elif provider == "google_ai_studio":
-        result = await aistudio_worker(context, prompt, job_id)
+        result = await aistudio_worker(context, prompt, job_id, spans)
     else:
         await send_log(job_id, f"❌ Неизвестный провайдер: {provider}", "error")
-        await submit_job_to_server(job_id, error_message=f"Unknown provider: {provider}")
+        await submit_job_to_server(job_id, error_message=f"Unknown provider: {provider}", trace_id=trace_id, spans=spans)
         return
     
     if result:
-        await submit_job_to_server(job_id, results=result)
+        await submit_job_to_server(job_id, results=result, trace_id=trace_id, spans=spans)
     else:
-        await submit_job_to_server(job_id, error_message="Failed to get response")
+        await submit_job_to_server(job_id, error_message="Failed to get response", trace_id=trace_id, spans=spans)
 
 
 async def main():
@@ -401,9 +619,12 @@ async def main():
             
             # Получение новых задач
             if len(active_tasks) < MAX_CONCURRENT_JOBS:
+                mark = span_mark()
                 job = await get_job_from_server()
                 if job:
-                    task = asyncio.create_task(process_job(context, job))
+                    spans = []
+                    close_span(spans, "get_job", mark)
+                    task = asyncio.create_task(process_job(context, job, spans))
                     active_tasks.append(task)
             
             await asyncio.sleep(POLLING_INTERVAL)
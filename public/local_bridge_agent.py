@@ -1,10 +1,13 @@
 import asyncio
+import gzip
 import json
 import urllib.request
 import httpx
 import re
 import sys
 import os
+import time
+from contextlib import contextmanager
 from playwright.async_api import async_playwright
 
 # Настройки подключения
@@ -12,6 +15,8 @@ SERVER_URL = "http://127.0.0.1:8000"
 DEBUG_HOST = "http://127.0.0.1:9333" 
 PERPLEXITY_URL = "https://www.perplexity.ai/"
 RULATE_BASE = "https://tl.rulate.ru"
+AGENT_NAME = "local_bridge"
+COMPRESS_MIN_SIZE = 1024  # тела меньше этого уходят без сжатия
 
 def get_ws_url():
     try:
@@ -23,7 +28,36 @@ def get_ws_url():
         print(f"❌ Браузер не отвечает. Ошибка: {e}")
         return None
 
-async def translate_worker(page, job):
+@contextmanager
+def trace_span(spans, stage, **meta):
+    """Замеряет этап задачи; спаны уходят на сервер вместе с результатом"""
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield meta
+    finally:
+        spans.append({
+            "stage": stage,
+            "agent": AGENT_NAME,
+            "start": start,
+            "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "meta": meta
+        })
+
+def compressed_json(payload):
+    """Тело и заголовки POST-запроса: JSON, сжатый gzip, если он не меньше COMPRESS_MIN_SIZE"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if len(body) >= COMPRESS_MIN_SIZE:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+async def submit_job(client, payload):
+    body, headers = compressed_json(payload)
+    return await client.post(f"{SERVER_URL}/agent-api/submit-job", content=body, headers=headers)
+
+async def translate_worker(page, job, spans):
     """Воркер для перевода через Perplexity"""
     results = []
     chapters = job.get("chapters", [])
@@ -39,17 +73,21 @@ async def translate_worker(page, job):
             full_prompt = f"{prompt}\n\nГлоссарий:\n{glossary_text}\n\nТекст для перевода:\n{ch.get('original_text', '')}"
             
             # Отправляем в Perplexity
-            await page.goto(PERPLEXITY_URL)
-            await page.wait_for_selector("textarea", timeout=10000)
-            await page.fill("textarea", full_prompt)
-            await page.keyboard.press("Enter")
+            with trace_span(spans, "prompt_entry", chapter_id=ch["id"], chars=len(full_prompt)):
+                await page.goto(PERPLEXITY_URL)
+                await page.wait_for_selector("textarea", timeout=10000)
+                await page.fill("textarea", full_prompt)
+                await page.keyboard.press("Enter")
             
             # Ждём ответ
-            await asyncio.sleep(15)
+            with trace_span(spans, "generation", chapter_id=ch["id"]):
+                await asyncio.sleep(15)
             
             # Получаем результат (упрощённо - нужно адаптировать под актуальную разметку)
-            response_el = await page.query_selector(".prose")
-            translated = await response_el.inner_text() if response_el else ""
+            with trace_span(spans, "html_extraction", chapter_id=ch["id"]) as meta:
+                response_el = await page.query_selector(".prose")
+                translated = await response_el.inner_text() if response_el else ""
+                meta["chars"] = len(translated)
             
             results.append({
                 "id": ch["id"],
@@ -183,22 +221,28 @@ async def main():
             ctx = browser.contexts[0]
             print("✅ Успешно! Ожидание задач от сервера...")
             
+            # httpx сам шлёт Accept-Encoding и распаковывает сжатые задачи
             async with httpx.AsyncClient(timeout=30.0) as client:
                 while True:
                     try:
-                        res = await client.get(f"{SERVER_URL}/agent-api/get-job")
+                        spans = []
+                        with trace_span(spans, "get_job"):
+                            res = await client.get(f"{SERVER_URL}/agent-api/get-job")
                         if res.status_code == 200:
                             job = res.json()
                             job_type = job.get("type")
                             
                             if job_type == "translate":
                                 print(f"\n🔥 Задача на ПЕРЕВОД: {len(job.get('chapters', []))} глав")
-                                page = await ctx.new_page()
+                                with trace_span(spans, "page_create"):
+                                    page = await ctx.new_page()
                                 try:
-                                    results = await translate_worker(page, job)
-                                    await client.post(f"{SERVER_URL}/agent-api/submit-job", json={
+                                    results = await translate_worker(page, job, spans)
+                                    await submit_job(client, {
                                         "type": "translate",
                                         "project_id": job.get("pid"),
+                                        "trace_id": job.get("trace_id"),
+                                        "spans": spans,
                                         "results": results
                                     })
                                     print(f"✅ Перевод завершён: {len(results)} глав")
@@ -208,23 +252,28 @@ async def main():
                             elif job_type == "publish":
                                 print(f"\n📤 Задача на ПУБЛИКАЦИЮ: {len(job.get('chapters', []))} глав")
                                 print(f"   URL книги: {job.get('book_url')}")
-                                page = await ctx.new_page()
+                                with trace_span(spans, "page_create"):
+                                    page = await ctx.new_page()
                                 try:
                                     for chapter in job.get("chapters", []):
-                                        result = await publish_chapter(
-                                            page, 
-                                            job.get("book_url"), 
-                                            chapter, 
-                                            job.get("settings", {})
-                                        )
-                                        await client.post(f"{SERVER_URL}/agent-api/submit-job", json={
+                                        with trace_span(spans, "publish_chapter", chapter_id=chapter["id"]):
+                                            result = await publish_chapter(
+                                                page, 
+                                                job.get("book_url"), 
+                                                chapter, 
+                                                job.get("settings", {})
+                                            )
+                                        await submit_job(client, {
                                             "type": "publish",
                                             "project_id": job.get("project_id"),
+                                            "trace_id": job.get("trace_id"),
+                                            "spans": spans,
                                             "chapter_id": chapter["id"],
                                             "success": result.get("success", False),
                                             "rulate_chapter_id": result.get("rulate_chapter_id"),
                                             "error": result.get("error")
                                         })
+                                        spans = []
                                     print(f"✅ Публикация завершена")
                                 finally:
                                     await page.close()
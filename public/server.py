@@ -1,13 +1,234 @@
 import json
+import asyncio
+import difflib
+import gzip
+import hashlib
+import html
+import io
+import re
+import sqlite3
+import tempfile
+import threading
+import zipfile
+import zlib
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import MutableHeaders
+from urllib.parse import quote
+from pydantic import BaseModel, ValidationError, field_validator
 from typing import List, Optional, Any, Dict
 import os
 import datetime
+import time
+import uuid
 
-app = FastAPI()
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def dumps(data):
+    """Компактная сериализация в bytes (orjson, если установлен)"""
+    if orjson:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Например, целые вне 64 бит — stdlib json их принимает
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(raw):
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+# --- Сжатие ---
+# Ответы от COMPRESS_MIN_SIZE байт сжимаются лучшим из кодеков, что понимает клиент
+# (zstd и br — если установлены zstandard / brotli). Тела запросов с Content-Encoding
+# распаковываются потоково, до обработчика они доходят уже обычными.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_OFFLOAD_SIZE = 256 * 1024   # крупнее — сжимаем вне цикла событий
+MAX_DECOMPRESSED_BODY = 1024 * 1024 * 1024
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/xhtml+xml", "text/")
+RESPONSE_ENCODINGS = [e for e, lib in (("zstd", zstandard), ("br", brotli), ("gzip", gzip)) if lib]
+
+def pick_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+        accepted[name.strip()] = q
+    for encoding in RESPONSE_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0: return encoding
+    return None
+
+# (обычный уровень, уровень для тел крупнее COMPRESS_OFFLOAD_SIZE): БД на десятки
+# мегабайт пересжимается после каждого сохранения, там скорость важнее пары процентов
+COMPRESS_LEVELS = {"zstd": (3, 1), "br": (4, 2), "gzip": (5, 1)}
+
+def compress_body(body, encoding):
+    level = COMPRESS_LEVELS[encoding][len(body) > COMPRESS_OFFLOAD_SIZE]
+    if encoding == "zstd": return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "br": return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+def stream_compressor(encoding):
+    """(сжать кусок, завершить поток)"""
+    level = COMPRESS_LEVELS[encoding][0]
+    if encoding == "zstd":
+        c = zstandard.ZstdCompressor(level=level).compressobj()
+        return c.compress, c.flush
+    if encoding == "br":
+        c = brotli.Compressor(quality=level)
+        return c.process, c.finish
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress, c.flush
+
+class ConcatenatedDecompressor:
+    """Читает подряд склеенные потоки: несколько gzip-членов (RFC 1952, pigz) или zstd-кадров.
+    После конца потока остаток уходит в unused_data — с него начинается следующий."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.d = factory()
+
+    def decompress(self, data):
+        out = []
+        while True:
+            if self.d.eof:
+                data = self.d.unused_data + data
+                if not data: break
+                self.d = self.factory()
+            out.append(self.d.decompress(data))
+            data = b""
+            if not (self.d.eof and self.d.unused_data): break
+        return b"".join(out)
+
+    def finished(self):
+        return self.d.eof
+
+def stream_decompressor(encoding):
+    """(decompress, finished): finished() говорит, дошёл ли поток до своего конца"""
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        d = ConcatenatedDecompressor(lambda: zlib.decompressobj(47))
+        return d.decompress, d.finished
+    if encoding == "zstd" and zstandard:
+        d = ConcatenatedDecompressor(lambda: zstandard.ZstdDecompressor().decompressobj())
+        return d.decompress, d.finished
+    if encoding == "br" and brotli:
+        d = brotli.Decompressor()
+        return d.process, d.is_finished
+    return None
+
+def should_compress(start, body, more_body):
+    if start["status"] < 200 or start["status"] in (204, 304): return False
+    headers = MutableHeaders(raw=start["headers"])
+    if "content-encoding" in headers or "content-range" in headers: return False
+    if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES): return False
+    return more_body or len(body) >= COMPRESS_MIN_SIZE
+
+async def compress_in_place(body, encoding):
+    if len(body) > COMPRESS_OFFLOAD_SIZE:
+        return await asyncio.get_running_loop().run_in_executor(None, compress_body, body, encoding)
+    return compress_body(body, encoding)
+
+def decompressing_receive(receive, decompressor):
+    decompress, finished = decompressor
+    total = 0
+    async def wrapped():
+        nonlocal total
+        message = await receive()
+        if message["type"] == "http.request":
+            try:
+                body = decompress(message.get("body", b""))
+            except Exception:
+                raise HTTPException(status_code=400, detail="Bad compressed body")
+            if not message.get("more_body", False) and not finished():
+                # Оборванный поток: без этой проверки приняли бы только начало тела
+                raise HTTPException(status_code=400, detail="Truncated compressed body")
+            total += len(body)
+            if total > MAX_DECOMPRESSED_BODY:
+                raise HTTPException(status_code=413, detail="Decompressed body too large")
+            message = dict(message, body=body)
+        return message
+    return wrapped
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        request_encoding = headers.get(b"content-encoding", b"").decode("latin-1").strip().lower()
+        if request_encoding and request_encoding != "identity":
+            decompressor = stream_decompressor(request_encoding)
+            if decompressor is None:
+                response = Response(f"Unsupported Content-Encoding: {request_encoding}", status_code=415)
+                return await response(scope, receive, send)
+            scope = dict(scope, headers=[(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")])
+            receive = decompressing_receive(receive, decompressor)
+
+        encoding = pick_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if not encoding or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        start, stream = None, None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                head, start = start, None
+                if not should_compress(head, body, more_body):
+                    await send(head)
+                    return await send(message)
+                out = MutableHeaders(raw=head["headers"])
+                out["Content-Encoding"] = encoding
+                out.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = await compress_in_place(body, encoding)
+                    out["Content-Length"] = str(len(body))
+                    await send(head)
+                    return await send({"type": "http.response.body", "body": body})
+                if "content-length" in out: del out["content-length"]
+                stream = stream_compressor(encoding)
+                await send(head)
+            if stream is None:
+                return await send(message)
+            chunk = stream[0](body) if body else b""
+            if not more_body: chunk += stream[1]()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,11 +237,42 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
 DB_FILE = "database.json"
+DB = None           # БД в памяти, меняется только под DB_LOCK
+DB_RAW = b"[]"      # сериализованная копия DB, отдаётся GET /api/projects
+DB_RAW_COMPRESSED = {}  # кодек -> (DB_RAW, future со сжатым DB_RAW)
+DB_LOCK = asyncio.Lock()
+DB_LOAD_LOCK = asyncio.Lock()
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
 JOB_QUEUE = []
 PUBLISH_QUEUE = []
 PROJECT_LOGS = {}
+TRACES = {}
+MAX_TRACES = 2000
+INGEST_JOBS = {}
+INGEST_BATCH = 200
+MAX_INGEST_FILES = 100000   # у Starlette по умолчанию max_files=1000
+EXPORT_CACHE_DIR = "exports"
+MAX_EXPORT_CACHE = 20
+EXPORT_LAYOUT = 2   # входит в ключ кеша: меняется вместе с устройством архивов
+HIEROGLYPH_CACHE = {}
+HIEROGLYPH_CACHE_LOCK = threading.Lock()   # сканы идут параллельно в потоках run_in_executor
+MAX_HIEROGLYPH_CACHE = 50000
+GLOSSARY_CHECKS = {}
+GLOSSARY_AUTOMATA = {}
+MAX_GLOSSARY_AUTOMATA = 16
+SEARCH_DB_FILE = "search.db"
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+SEARCH_CONN = None
+SEARCH_SYNCED = set()
+SEARCH_PENDING = {}
+SEARCH_PENDING_LOCK = threading.Lock()
+HISTORY_DB_FILE = "history.db"
+HISTORY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+HISTORY_CONN = None
+HISTORY_SNAPSHOT_EVERY = 10
 
 # --- Модели ---
 class Project(BaseModel):
@@ -46,6 +298,26 @@ class PublishJobRequest(BaseModel):
     subscription_only: bool = True
     add_as_translation: bool = True
 
+class IngestChapter(BaseModel):
+    title: str = ""
+    original_text: str
+    number: Optional[int] = None
+    id: Optional[str] = None
+
+    @field_validator('original_text')
+    @classmethod
+    def not_empty(cls, v):
+        if not v.strip(): raise ValueError("empty original_text")
+        return v
+
+class HieroglyphScanRequest(BaseModel):
+    project_id: str
+    chapter_ids: Optional[List[str]] = None
+    max_matches: int = 20
+    requeue: bool = False
+    system_prompt: Optional[str] = None
+    batch_size: int = 5
+
 class RulateSettingsRequest(BaseModel):
     project_id: str
     book_url: str
@@ -55,69 +327,1200 @@ class RulateSettingsRequest(BaseModel):
     add_as_translation: bool = True
 
 # --- БД ---
-def load_db():
+# Все изменения БД делаются так:
+#     async with DB_LOCK:
+#         db = await load_db()
+#         ...
+#         await save_db(db)
+# Чтение без изменений блокировку не берёт.
+def read_db_file():
     if not os.path.exists(DB_FILE): return []
     try:
-        with open(DB_FILE, "r", encoding="utf-8") as f: return json.load(f)
+        with open(DB_FILE, "rb") as f: return loads(f.read())
     except: return []
 
-def save_db(data):
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+def write_db_file(data):
+    raw = dumps(data)
+    tmp = DB_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, DB_FILE)
+    return raw
+
+async def run_db(fn, *args):
+    """Выполняет файловую операцию в единственном потоке записи"""
+    return await asyncio.get_running_loop().run_in_executor(DB_EXECUTOR, fn, *args)
+
+async def load_db():
+    global DB, DB_RAW
+    if DB is None:
+        async with DB_LOAD_LOCK:
+            if DB is None:
+                data = await run_db(read_db_file)
+                DB_RAW = await run_db(dumps, data)
+                DB = data
+    return DB
+
+async def save_db(data):
+    """Записывает базу; DB и DB_RAW меняются только после успешной записи.
+    Обработчики правят DB на месте, поэтому при ошибке он восстанавливается из DB_RAW."""
+    global DB, DB_RAW
+    try:
+        raw = await run_db(write_db_file, data)
+    except Exception:
+        DB = await run_db(loads, DB_RAW)
+        raise
+    DB_RAW, DB = raw, data
 
 def add_log(pid, msg, type="info"):
     if pid not in PROJECT_LOGS: PROJECT_LOGS[pid] = []
     ts = datetime.datetime.now().strftime("%H:%M:%S")
     PROJECT_LOGS[pid].append({"time": ts, "msg": msg, "type": type})
 
+def log_failure(pid, what, on_error=None):
+    """done-callback для фоновых задач в executor'ах: ошибку иначе никто не увидит"""
+    def done(future):
+        error = future.exception()
+        if error is None: return
+        print(f"❌ {what} ({pid}): {error!r}")
+        add_log(pid, f"{what}: {error}", "error")
+        if on_error: on_error()
+    return done
+
+# --- Трассировка задач ---
+def new_trace(pid, kind, trace_id=None):
+    """Создаёт трассу задачи и возвращает её trace_id"""
+    trace_id = trace_id or uuid.uuid4().hex
+    TRACES[trace_id] = {"trace_id": trace_id, "pid": pid, "type": kind, "created_at": time.time(), "spans": []}
+    while len(TRACES) > MAX_TRACES:
+        del TRACES[next(iter(TRACES))]
+    return trace_id
+
+def add_span(trace_id, stage, start, end, agent="server", meta=None):
+    trace = TRACES.get(trace_id)
+    if not trace: return
+    trace['spans'].append({
+        "stage": stage,
+        "agent": agent,
+        "start": start,
+        "duration_ms": round((end - start) * 1000, 1),
+        "meta": meta or {}
+    })
+
+def add_agent_spans(trace_id, spans, agent="agent", pid=None, kind="agent"):
+    """Принимает спаны, присланные агентом вместе с результатом.
+    Если trace_id выдал сам агент (задача пришла не через эту очередь), трасса заводится здесь."""
+    if spans and trace_id not in TRACES:
+        new_trace(pid, kind, trace_id)
+    for sp in spans or []:
+        try:
+            start = float(sp['start'])
+            end = start + float(sp['duration_ms']) / 1000
+        except (KeyError, TypeError, ValueError):
+            continue
+        add_span(trace_id, sp.get('stage', 'unknown'), start, end, sp.get('agent', agent), sp.get('meta'))
+
+def trace_waterfall(trace):
+    """Спаны задачи, отсортированные по началу, со смещением от старта трассы"""
+    spans = sorted(trace['spans'], key=lambda sp: sp['start'])
+    t0 = min([trace['created_at']] + [sp['start'] for sp in spans])
+    t1 = max([t0] + [sp['start'] + sp['duration_ms'] / 1000 for sp in spans])
+    return {
+        "trace_id": trace['trace_id'],
+        "project_id": trace['pid'],
+        "type": trace['type'],
+        "total_ms": round((t1 - t0) * 1000, 1),
+        "spans": [dict(sp, offset_ms=round((sp['start'] - t0) * 1000, 1)) for sp in spans]
+    }
+
+def percentile(values, q):
+    if not values: return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def stage_breakdown(traces):
+    """Сводка по этапам: сколько времени уходит на каждый этап"""
+    durations = {}
+    for t in traces:
+        for sp in t['spans']:
+            durations.setdefault(sp['stage'], []).append(sp['duration_ms'])
+    grand_total = sum(sum(v) for v in durations.values()) or 1
+    stages = {}
+    for stage, values in durations.items():
+        total = sum(values)
+        stages[stage] = {
+            "count": len(values),
+            "total_ms": round(total, 1),
+            "avg_ms": round(total / len(values), 1),
+            "p50_ms": percentile(values, 0.5),
+            "p95_ms": percentile(values, 0.95),
+            "max_ms": max(values),
+            "share": round(total / grand_total, 4)
+        }
+    return dict(sorted(stages.items(), key=lambda kv: -kv[1]['total_ms']))
+
 # --- API ---
+async def compressed_db_raw(encoding):
+    """Сжатая копия DB_RAW: сжимается один раз на каждое сохранение, а не на каждый
+    запрос; одновременные запросы ждут одно и то же сжатие"""
+    raw = DB_RAW
+    cached = DB_RAW_COMPRESSED.get(encoding)
+    if not cached or cached[0] is not raw:
+        future = asyncio.get_running_loop().run_in_executor(None, compress_body, raw, encoding)
+        cached = DB_RAW_COMPRESSED[encoding] = (raw, future)
+    return await cached[1]
+
 @app.get("/api/projects")
-def get_projects(): return load_db()
+async def get_projects(request: Request):
+    await load_db()
+    encoding = pick_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and len(DB_RAW) >= COMPRESS_MIN_SIZE:
+        body = await compressed_db_raw(encoding)
+        return Response(content=body, media_type="application/json",
+                        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+    return Response(content=DB_RAW, media_type="application/json")
 
 @app.post("/api/projects/save")
-def save_project(project: Project):
-    db = load_db()
-    updated = False
+async def save_project(project: Project):
     p_dict = project.dict()
-    for i, p in enumerate(db):
-        if p['id'] == project.id:
-            db[i] = p_dict
-            updated = True
-            break
-    if not updated: db.append(p_dict)
-    save_db(db)
+    async with DB_LOCK:
+        db = await load_db()
+        updated = False
+        changes = translation_changes([], p_dict['chapters'])
+        for i, p in enumerate(db):
+            if p['id'] == project.id:
+                changes = translation_changes(p['chapters'], p_dict['chapters'])
+                db[i] = p_dict
+                updated = True
+                break
+        if not updated: db.append(p_dict)
+        await save_db(db)
+    schedule_revisions(project.id, changes, "editor")
+    schedule_index(project.id, p_dict['chapters'], full=True)
     return {"status": "saved"}
 
 @app.get("/api/logs/{project_id}")
-def get_logs(project_id: str): return PROJECT_LOGS.get(project_id, [])
+async def get_logs(project_id: str): return PROJECT_LOGS.get(project_id, [])
 
 @app.post("/api/glossary/replace")
-def global_replace(req: ReplaceRequest):
+async def global_replace(req: ReplaceRequest):
     """Глобальная замена термина во всех переведенных главах"""
-    db = load_db()
-    project_found = False
-    
-    for p in db:
-        if p['id'] == req.project_id:
-            project_found = True
-            
-            for term in p['glossary']:
-                if term.get('original') == req.term_original:
-                    if 'russian_translation' in term:
-                        term['russian_translation'] = req.new_russian
-                    if 'russian-translation' in term:
-                        term['russian-translation'] = req.new_russian
-            
-            save_db(db)
-            add_log(req.project_id, f"Термин '{req.term_original}' обновлен на '{req.new_russian}'.", "success")
-            return {"status": "replaced"}
+    async with DB_LOCK:
+        db = await load_db()
+        
+        for p in db:
+            if p['id'] == req.project_id:
+                for term in p['glossary']:
+                    if term.get('original') == req.term_original:
+                        if 'russian_translation' in term:
+                            term['russian_translation'] = req.new_russian
+                        if 'russian-translation' in term:
+                            term['russian-translation'] = req.new_russian
+                
+                await save_db(db)
+                add_log(req.project_id, f"Термин '{req.term_original}' обновлен на '{req.new_russian}'.", "success")
+                return {"status": "replaced"}
             
     return {"status": "error", "msg": "Project not found"}
 
+# --- Массовый импорт глав ---
+# Тот же шаблон заголовка, что и в chapterParser.ts на клиенте
+CHAPTER_HEADING_RE = re.compile(r"^第[一二三四五六七八九十百千\d]+章")
+TEXT_FILE_EXTS = (".txt", ".md")
+
+def content_hash(text):
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()
+
+def natural_key(name):
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", name)]
+
+def split_text_chapters(lines, filename):
+    """Режет текст на главы по строкам 第X章 не загружая файл целиком.
+    Если заголовков нет, весь файл — одна глава с названием из имени файла."""
+    stem = os.path.splitext(os.path.basename(filename or ""))[0]
+    title, buf, seen_heading = None, [], False
+    for line in lines:
+        if CHAPTER_HEADING_RE.match(line):
+            if seen_heading and buf:
+                yield {"title": title, "original_text": "".join(buf).strip()}
+            title, buf, seen_heading = line.strip(), [line], True
+        elif seen_heading or line.strip() or buf:
+            buf.append(line)
+    if buf:
+        if seen_heading:
+            yield {"title": title, "original_text": "".join(buf).strip()}
+        else:
+            # Имя вида "12.txt" ничего не говорит — название возьмётся по номеру
+            yield {"title": "" if stem.isdigit() else stem, "original_text": "".join(buf).strip()}
+
+async def ndjson_records(request):
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if line.strip(): yield line
+    if buf.strip(): yield buf
+
+async def text_file_records(files):
+    """files: [(имя, бинарный файл)] в порядке глав"""
+    for name, f in files:
+        lines = io.TextIOWrapper(f, encoding="utf-8-sig", errors="replace")
+        for i, rec in enumerate(split_text_chapters(lines, name)):
+            yield rec
+            if i % INGEST_BATCH == 0: await asyncio.sleep(0)
+
+async def multipart_records(request):
+    try:
+        form = await request.form(max_files=MAX_INGEST_FILES)
+    except AssertionError as e:
+        # Starlette без python-multipart
+        raise HTTPException(status_code=415, detail=str(e))
+    files = [(v.filename, v.file) for _, v in form.multi_items() if hasattr(v, "filename") and v.filename]
+    files.sort(key=lambda item: natural_key(item[0]))
+    try:
+        async for rec in text_file_records(files):
+            yield rec
+    finally:
+        await form.close()
+
+async def zip_records(request):
+    # ZIP читается с конца (central directory), поэтому тело сначала уходит во временный файл
+    with tempfile.TemporaryFile() as tmp:
+        async for chunk in request.stream():
+            tmp.write(chunk)
+        tmp.seek(0)
+        try:
+            zf = zipfile.ZipFile(tmp)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Bad ZIP file")
+        with zf:
+            names = sorted((n for n in zf.namelist() if n.lower().endswith(TEXT_FILE_EXTS)), key=natural_key)
+            for name in names:
+                with zf.open(name) as f:
+                    async for rec in text_file_records([(name, f)]):
+                        yield rec
+
+def detect_ingest_format(request, fmt):
+    if fmt: return fmt
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype.startswith("multipart/"): return "multipart"
+    if "zip" in ctype: return "zip"
+    if ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl"): return "ndjson"
+    return None
+
+async def flush_ingest_batch(project_id, batch):
+    """Дописывает пачку в проект. Дубли и нумерация проверяются здесь, под DB_LOCK,
+    чтобы параллельные импорты в один проект не задвоили главы и номера.
+    Возвращает (добавлено, дублей) или None, если проекта уже нет."""
+    async with DB_LOCK:
+        db = await load_db()
+        project = next((p for p in db if p['id'] == project_id), None)
+        if not project: return None
+        known = {ch.get('content_hash') or content_hash(ch.get('original_text', '')) for ch in project['chapters']}
+        known_ids = {ch['id'] for ch in project['chapters']}
+        next_number = max([ch.get('number') or 0 for ch in project['chapters']] + [0]) + 1
+        created_at = datetime.date.today().isoformat()
+        added = []
+        for item, h in batch:
+            if h in known: continue
+            known.add(h)
+            number = item.number or next_number
+            next_number = max(next_number, number) + 1
+            ch_id = item.id if item.id and item.id not in known_ids else f"ch_{uuid.uuid4().hex[:12]}"
+            known_ids.add(ch_id)
+            added.append({
+                "id": ch_id,
+                "number": number,
+                "title": item.title or f"Глава {number}",
+                "original_text": item.original_text,
+                "status": "pending",
+                "created_at": created_at,
+                "content_hash": h
+            })
+        if added:
+            project['chapters'].extend(added)
+            await save_db(db)
+    if added: schedule_index(project_id, added)
+    return len(added), len(batch) - len(added)
+
+async def ingest_records(project_id, records, progress, parse_json=False):
+    """Проверяет главы по одной и пишет пачками; дубли по хэшу текста отбрасываются при записи"""
+    db = await load_db()
+    if not any(p['id'] == project_id for p in db): raise HTTPException(status_code=404, detail="Project not found")
+    batch = []
+
+    async def flush():
+        result = await flush_ingest_batch(project_id, batch)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        progress['added'] += result[0]
+        progress['duplicates'] += result[1]
+
+    async for raw in records:
+        progress['received'] += 1
+        try:
+            item = IngestChapter.model_validate_json(raw) if parse_json else IngestChapter(**raw)
+        except ValidationError as e:
+            progress['invalid'] += 1
+            if len(progress['errors']) < 50:
+                progress['errors'].append({"record": progress['received'], "error": e.errors(include_url=False)[0]['msg']})
+            continue
+        batch.append((item, content_hash(item.original_text)))
+        if len(batch) >= INGEST_BATCH:
+            await flush()
+            batch = []
+    if batch:
+        await flush()
+
+@app.post("/api/projects/{project_id}/ingest")
+async def ingest_chapters(project_id: str, request: Request, format: Optional[str] = None, ingest_id: Optional[str] = None):
+    """Потоковый импорт глав: NDJSON, multipart с TXT-файлами или ZIP.
+    Ход импорта можно опрашивать через GET /api/ingest/{ingest_id}."""
+    fmt = detect_ingest_format(request, format)
+    sources = {"ndjson": ndjson_records, "multipart": multipart_records, "zip": zip_records}
+    if fmt not in sources:
+        raise HTTPException(status_code=415, detail="Expected NDJSON, multipart/form-data or ZIP")
+
+    ingest_id = ingest_id or uuid.uuid4().hex
+    while len(INGEST_JOBS) >= 100:
+        del INGEST_JOBS[next(iter(INGEST_JOBS))]
+    progress = INGEST_JOBS[ingest_id] = {
+        "ingest_id": ingest_id, "project_id": project_id, "format": fmt, "status": "running",
+        "received": 0, "added": 0, "duplicates": 0, "invalid": 0, "errors": [],
+        "started_at": time.time(), "finished_at": None
+    }
+    try:
+        await ingest_records(project_id, sources[fmt](request), progress, parse_json=(fmt == "ndjson"))
+    except Exception as e:
+        progress['status'] = "error"
+        progress['errors'].append({"error": getattr(e, "detail", str(e))})
+        raise
+    finally:
+        progress['finished_at'] = time.time()
+    progress['status'] = "done"
+    add_log(project_id, f"Импорт: добавлено {progress['added']} глав, дублей {progress['duplicates']}, ошибок {progress['invalid']}.", "success")
+    return progress
+
+@app.get("/api/ingest/{ingest_id}")
+async def get_ingest_progress(ingest_id: str):
+    progress = INGEST_JOBS.get(ingest_id)
+    if not progress: raise HTTPException(status_code=404, detail="Ingest not found")
+    return progress
+
+# --- Экспорт книги ---
+EXPORT_TYPES = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "zip": ("application/zip", "zip"),
+    "epub": ("application/epub+zip", "epub"),
+}
+DEFAULT_EXPORT_STATUSES = ("completed", "published", "publishing")
+
+INLINE_MD_RE = re.compile(r"`([^`]+)`|\\([*_`\\])|(\*{1,3})")
+STAR_TAGS = {1: ("em",), 2: ("strong",), 3: ("strong", "em")}
+STAR_MARKS = {"strong": "**", "em": "*"}
+
+def inline_markdown(text):
+    """*курсив*, **жирный**, ***оба***, `код` и экранирование \\* \\_ в XHTML.
+    Теги всегда вложены правильно: перекрёстное закрытие переоткрывает внутренние теги,
+    а звёздочки без пары (и окружённые пробелами, как в «* * *») остаются текстом."""
+    out, stack = [], []   # stack: [тег, индекс открывающего токена в out или None, если переоткрыт]
+
+    def close(tags):
+        depth = min(i for i, entry in enumerate(stack) if entry[0] in tags)
+        reopen = [entry[0] for entry in stack[depth:] if entry[0] not in tags]
+        for entry in reversed(stack[depth:]):
+            out.append(f"</{entry[0]}>")
+        del stack[depth:]
+        for tag in reopen:
+            out.append(f"<{tag}>")
+            stack.append([tag, None])
+
+    pos = 0
+    for m in INLINE_MD_RE.finditer(text):
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        if m.group(1) is not None:
+            out.append(f"<code>{m.group(1)}</code>")
+        elif m.group(2) is not None:
+            out.append(m.group(2))
+        else:
+            tags = STAR_TAGS[len(m.group(3))]
+            before = text[m.start() - 1] if m.start() else " "
+            after = text[m.end()] if m.end() < len(text) else " "
+            opened = [tag for tag in tags if any(entry[0] == tag for entry in stack)]
+            if opened and not before.isspace():
+                close(opened)
+                tags = [tag for tag in tags if tag not in opened]
+                if tags and after.isspace():
+                    out.append(STAR_MARKS[tags[0]])
+                    continue
+            else:
+                tags = [tag for tag in tags if tag not in opened]
+                if not tags or after.isspace():
+                    out.append(m.group(3))
+                    continue
+            for tag in tags:
+                stack.append([tag, len(out)])
+                out.append(f"<{tag}>")
+    out.append(text[pos:])
+    for tag, index in reversed(stack):
+        if index is None: out.append(f"</{tag}>")
+        else: out[index] = STAR_MARKS[tag]
+    return "".join(out)
+
+def markdown_to_html(text):
+    """Минимальный markdown агентов (#-заголовки, абзацы, *курсив*, **жирный**, `код`) в XHTML"""
+    blocks = []
+    for block in re.split(r"\n\s*\n", text.strip()):
+        block = html.escape(block.strip(), quote=False)
+        if not block: continue
+        block = inline_markdown(block)
+        heading = re.match(r"^(#{1,6})\s+(.*)", block)
+        if heading:
+            level = len(heading.group(1))
+            blocks.append(f"<h{level}>{heading.group(2)}</h{level}>")
+        else:
+            blocks.append("<p>" + block.replace("\n", "<br/>") + "</p>")
+    return "\n".join(blocks)
+
+def xhtml_page(title, body):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="ru">\n'
+        f'<head><meta charset="utf-8"/><title>{html.escape(title)}</title></head>\n'
+        f'<body>\n<h1>{html.escape(title)}</h1>\n{body}\n</body>\n</html>\n'
+    )
+
+class ChunkSink:
+    """Несжимаемый поток для zipfile: накопленное забирается через take()"""
+    def __init__(self):
+        self.parts = []
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+    def flush(self):
+        pass
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def export_txt(chapters):
+    for ch in chapters:
+        yield f"{ch['title']}\n\n{ch['text'].strip()}\n\n\n".encode("utf-8")
+
+def export_zip(chapters, content):
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        # Имена по порядку в выдаче, а не по номеру: номера глав в редакторе могут повторяться
+        for i, ch in enumerate(chapters, 1):
+            name = f"{i:05d}"
+            if content == "html":
+                zf.writestr(f"{name}.html", xhtml_page(ch['title'], markdown_to_html(ch['text'])))
+            else:
+                zf.writestr(f"{name}.md", f"# {ch['title']}\n\n{ch['text'].strip()}\n")
+            yield sink.take()
+    yield sink.take()
+
+def export_epub(chapters, book_title, book_id):
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        # mimetype обязан быть первым и несжатым
+        zf.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml",
+            '<?xml version="1.0"?>\n<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        yield sink.take()
+        # Файлы и id манифеста — по порядку в книге: номера глав могут повторяться
+        for i, ch in enumerate(chapters, 1):
+            zf.writestr(f"OEBPS/ch{i:05d}.xhtml", xhtml_page(ch['title'], markdown_to_html(ch['text'])))
+            yield sink.take()
+        items = "".join(f'<item id="ch{i:05d}" href="ch{i:05d}.xhtml" media-type="application/xhtml+xml"/>' for i in range(1, len(chapters) + 1))
+        spine = "".join(f'<itemref idref="ch{i:05d}"/>' for i in range(1, len(chapters) + 1))
+        zf.writestr("OEBPS/content.opf",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="bookid">urn:uuid:{book_id}</dc:identifier>'
+            f'<dc:title>{html.escape(book_title)}</dc:title><dc:language>ru</dc:language>'
+            f'<meta property="dcterms:modified">{datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}</meta>'
+            '</metadata>'
+            f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{items}</manifest>'
+            f'<spine>{spine}</spine></package>')
+        toc = "".join(f'<li><a href="ch{i:05d}.xhtml">{html.escape(ch["title"])}</a></li>' for i, ch in enumerate(chapters, 1))
+        zf.writestr("OEBPS/nav.xhtml", xhtml_page(book_title, f'<nav epub:type="toc"><ol>{toc}</ol></nav>'))
+    yield sink.take()
+
+def export_cache_key(project, chapters, fmt, content):
+    h = hashlib.sha1(f"{EXPORT_LAYOUT}|{project['id']}|{project.get('name', '')}|{fmt}|{content}".encode("utf-8"))
+    for ch in chapters:
+        h.update(f"|{ch['number']}|{ch['title']}|".encode("utf-8"))
+        h.update(ch['text'].encode("utf-8"))
+    return h.hexdigest()
+
+def cached_export(generator, path):
+    """Отдаёт куски экспорта и параллельно пишет их в кэш; недописанный файл удаляется"""
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    done = False
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in generator:
+                if not chunk: continue
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp, path)
+        done = True
+        cached = sorted((os.path.join(EXPORT_CACHE_DIR, n) for n in os.listdir(EXPORT_CACHE_DIR) if not n.endswith(".tmp")),
+                        key=os.path.getmtime)
+        for old in cached[:-MAX_EXPORT_CACHE]:
+            os.remove(old)
+    finally:
+        if not done and os.path.exists(tmp):
+            os.remove(tmp)
+
+@app.get("/api/projects/{project_id}/export")
+async def export_project(request: Request, project_id: str, format: str = "epub", content: str = "md",
+                         chapter_from: Optional[int] = None, chapter_to: Optional[int] = None,
+                         status: Optional[str] = None):
+    """Экспорт переведённых глав по порядку номеров: epub, zip (md/html) или txt.
+    status — через запятую, "all" — любые главы с переводом."""
+    if format not in EXPORT_TYPES: raise HTTPException(status_code=400, detail="format: epub, zip or txt")
+    if content not in ("md", "html"): raise HTTPException(status_code=400, detail="content: md or html")
+    db = await load_db()
+    project = next((p for p in db if p['id'] == project_id), None)
+    if not project: raise HTTPException(status_code=404, detail="Project not found")
+
+    statuses = None if status == "all" else set((status or ",".join(DEFAULT_EXPORT_STATUSES)).split(","))
+    # Снимок ссылок на строки глав: сами тексты не копируются
+    chapters = []
+    for i, ch in enumerate(project['chapters']):
+        number = ch.get('number') or i + 1
+        if not ch.get('translated_text'): continue
+        if statuses is not None and ch.get('status') not in statuses: continue
+        if chapter_from is not None and number < chapter_from: continue
+        if chapter_to is not None and number > chapter_to: continue
+        chapters.append({"number": number, "title": ch.get('title') or f"Глава {number}", "text": ch['translated_text']})
+    chapters.sort(key=lambda ch: ch['number'])
+    if not chapters: raise HTTPException(status_code=404, detail="No translated chapters match the filter")
+
+    media_type, ext = EXPORT_TYPES[format]
+    key = await asyncio.get_running_loop().run_in_executor(None, export_cache_key, project, chapters, format, content)
+    etag = f'"{key}"'
+    filename = quote(f"{project.get('name') or project_id}.{ext}")
+    headers = {"ETag": etag, "Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    path = os.path.join(EXPORT_CACHE_DIR, f"{key}.{ext}")
+    if os.path.exists(path):
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    if format == "txt":
+        generator = export_txt(chapters)
+    elif format == "zip":
+        generator = export_zip(chapters, content)
+    else:
+        generator = export_epub(chapters, project.get('name') or project_id, uuid.uuid5(uuid.NAMESPACE_URL, project_id))
+    add_log(project_id, f"Экспорт {format.upper()}: {len(chapters)} глав.", "info")
+    return StreamingResponse(cached_export(generator, path), media_type=media_type, headers=headers)
+
+# --- Поиск иероглифов ---
+# Те же диапазоны, что и в FindHieroglyphsDialog.tsx на клиенте; подряд идущие
+# иероглифы — один непереведённый фрагмент
+HIEROGLYPH_RE = re.compile("[\u4e00-\u9fff\u3400-\u4dbf\U00020000-\U0002a6df\U0002a700-\U0002ceaf]+")
+HIEROGLYPH_CONTEXT = 20
+
+def scan_hieroglyphs(text):
+    """Все фрагменты с иероглифами в тексте: смещения и контекст вокруг"""
+    count, unique, matches = 0, set(), []
+    for m in HIEROGLYPH_RE.finditer(text):
+        count += m.end() - m.start()
+        unique.update(m.group())
+        start = max(0, m.start() - HIEROGLYPH_CONTEXT)
+        matches.append({
+            "offset": m.start(),
+            "length": m.end() - m.start(),
+            "text": m.group(),
+            "context_offset": start,
+            "context": text[start:m.end() + HIEROGLYPH_CONTEXT]
+        })
+    return {"count": count, "unique": len(unique), "matches": matches}
+
+def scan_chapters(chapters):
+    """Сканирует главы, пересчитывая только тексты, которых ещё нет в кеше.
+    Возвращает [(глава, sha1 текста, результат)] и число пересканированных глав."""
+    results, rescanned = [], 0
+    for ch in chapters:
+        text = ch.get('translated_text') or ''
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        result = HIEROGLYPH_CACHE.get(key)
+        if result is None:
+            result = scan_hieroglyphs(text)
+            rescanned += 1
+            with HIEROGLYPH_CACHE_LOCK:
+                while len(HIEROGLYPH_CACHE) >= MAX_HIEROGLYPH_CACHE:
+                    HIEROGLYPH_CACHE.pop(next(iter(HIEROGLYPH_CACHE)), None)
+                HIEROGLYPH_CACHE[key] = result
+        results.append((ch, key, result))
+    return results, rescanned
+
+@app.post("/api/hieroglyphs/scan")
+async def find_hieroglyphs(req: HieroglyphScanRequest):
+    """Непереведённые иероглифы в translated_text глав проекта (всех или chapter_ids).
+    С requeue главы с иероглифами снова отправляются в перевод через send_job."""
+    db = await load_db()
+    project = next((p for p in db if p['id'] == req.project_id), None)
+    if not project: raise HTTPException(status_code=404, detail="Project not found")
+
+    wanted = set(req.chapter_ids) if req.chapter_ids is not None else None
+    chapters = [ch for ch in project['chapters'] if ch.get('translated_text') and (wanted is None or ch['id'] in wanted)]
+    results, rescanned = await asyncio.get_running_loop().run_in_executor(None, scan_chapters, chapters)
+
+    found = [{
+        "id": ch['id'],
+        "title": ch.get('title', ''),
+        "count": r['count'],
+        "unique": r['unique'],
+        "fragments": len(r['matches']),
+        "matches": r['matches'][:req.max_matches]
+    } for ch, _, r in results if r['count']]
+
+    requeued = 0
+    if req.requeue and found:
+        await send_job({
+            "project_id": req.project_id,
+            "chapter_ids": [c['id'] for c in found],
+            "system_prompt": req.system_prompt if req.system_prompt is not None else project.get('system_prompt', ''),
+            "batch_size": req.batch_size
+        })
+        requeued = len(found)
+
+    return {
+        "status": "ok",
+        "scanned": len(chapters),
+        "rescanned": rescanned,
+        # sha1 просканированных текстов: клиент сверяет их со своими, несохранёнными правками
+        "hashes": {ch['id']: key for ch, key, _ in results},
+        "total_matches": sum(c['count'] for c in found),
+        "chapters": found,
+        "requeued": requeued
+    }
+
+# --- Проверка глоссария ---
+# Оригиналы терминов ищутся по символам в original_text, переводы — по основам
+# слов в translated_text, чтобы "Линь Фэн" находился и как "Линя Фэна"
+RU_ENDINGS = sorted(("ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ой", "ей", "ом", "ем", "ам", "ям",
+                     "ах", "ях", "ов", "ев", "ую", "юю", "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий",
+                     "а", "я", "о", "е", "у", "ю", "ы", "и", "ь", "й"), key=len, reverse=True)
+WORD_RE = re.compile(r"\w+")
+NO_ALT = {"", "нет", "-", "—"}
+
+class TermAutomaton:
+    """Ахо-Корасик: все вхождения набора последовательностей за один проход.
+    Последовательности — строки (по символам) или кортежи основ слов."""
+    def __init__(self, patterns):
+        self.goto, self.fail, self.out = [{}], [0], [[]]
+        for pattern in patterns:
+            state = 0
+            for item in pattern:
+                nxt = self.goto[state].get(item)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][item] = nxt
+                    self.goto.append({}); self.fail.append(0); self.out.append([])
+                state = nxt
+            self.out[state].append(pattern)
+        queue = [0]
+        for state in queue:
+            for item, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state == 0: continue
+                f = self.fail[state]
+                while f and item not in self.goto[f]: f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(item, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def finditer(self, seq):
+        """(начало, паттерн) для каждого вхождения"""
+        state = 0
+        for i, item in enumerate(seq):
+            while state and item not in self.goto[state]: state = self.fail[state]
+            state = self.goto[state].get(item, 0)
+            for pattern in self.out[state]:
+                yield i - len(pattern) + 1, pattern
+
+    def count_longest(self, seq):
+        """Вхождения без перекрытий, длинный термин важнее вложенного в него короткого"""
+        matches = sorted(self.finditer(seq), key=lambda m: (m[0], -len(m[1])))
+        counts, pos = {}, 0
+        for start, pattern in matches:
+            if start < pos: continue
+            counts[pattern] = counts.get(pattern, 0) + 1
+            pos = start + len(pattern)
+        return counts
+
+def ru_stem(word):
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 2:
+            return word[:-len(ending)]
+    return word
+
+def stem_words(text):
+    return tuple(ru_stem(w) for w in WORD_RE.findall(text.lower().replace("ё", "е")))
+
+def glossary_terms(glossary):
+    """{оригинал: (ожидаемый перевод, [альтернативы])} из записей глоссария"""
+    terms = {}
+    for g in glossary:
+        original = (g.get('original') or '').strip()
+        expected = (g.get('russian-translation') or g.get('russian_translation') or '').strip()
+        if not original or not expected: continue
+        alt = g.get('alt-russian-translation') or g.get('alt_russian_translation') or ''
+        alts = [a.strip() for a in re.split(r"[,;/]", alt) if a.strip().lower() not in NO_ALT]
+        terms[original] = (expected, [a for a in alts if stem_words(a) != stem_words(expected)])
+    return terms
+
+def term_automata(terms):
+    """Автоматы оригиналов и переводов, общие для одинаковых глоссариев"""
+    key = hashlib.sha1(dumps(sorted(terms.items()))).hexdigest()
+    automata = GLOSSARY_AUTOMATA.get(key)
+    if automata is None:
+        renderings = {}
+        for original, (expected, alts) in terms.items():
+            for text in [expected] + alts:
+                stems = stem_words(text)
+                if stems: renderings.setdefault(stems, []).append(original)
+        automata = (TermAutomaton(terms), TermAutomaton(renderings), renderings)
+        if len(GLOSSARY_AUTOMATA) >= MAX_GLOSSARY_AUTOMATA:
+            GLOSSARY_AUTOMATA.pop(next(iter(GLOSSARY_AUTOMATA)), None)
+        GLOSSARY_AUTOMATA[key] = automata
+    return automata
+
+def compare_renderings(source_terms, translated, terms, automata):
+    """Термины из оригинала, которых нет в переводе или которые переведены альтернативой"""
+    _, rendering_ac, renderings = automata
+    # Без перекрытий: альтернатива "Фэн" внутри ожидаемого "Линь Фэн" не считается
+    found = set(rendering_ac.count_longest(stem_words(translated)))
+    missing, alternative = [], []
+    for original, occurrences in sorted(source_terms.items(), key=lambda t: -t[1]):
+        expected, alts = terms[original]
+        expected_found = stem_words(expected) in found
+        used_alts = [a for a in alts if stem_words(a) in found]
+        if used_alts:
+            alternative.append({"original": original, "expected": expected, "found": used_alts,
+                                "expected_found": expected_found, "occurrences": occurrences})
+        elif not expected_found:
+            missing.append({"original": original, "expected": expected, "occurrences": occurrences})
+    return {"missing": missing, "alternative": alternative}
+
+def check_chapter(ch, terms, automata, state):
+    """Новое состояние проверки главы. Пересчитывается только то, что изменилось:
+    текст главы, набор оригиналов глоссария или переводы встреченных в главе терминов."""
+    original, translated = ch.get('original_text') or '', ch['translated_text']
+    source_key = hashlib.sha1(original.encode("utf-8")).hexdigest()
+    translated_key = hashlib.sha1(translated.encode("utf-8")).hexdigest()
+    originals = frozenset(terms)
+    state = state or {}
+
+    source_terms = state.get('source_terms')
+    if state.get('source_key') != source_key:
+        source_terms = None
+    elif state.get('originals') != originals:
+        added, removed = originals - state['originals'], state['originals'] - originals
+        if removed & source_terms.keys() or any(o in original for o in added):
+            source_terms = None
+    rescanned = source_terms is None
+    if rescanned:
+        source_terms = automata[0].count_longest(original)
+
+    terms_sig = [(o, terms[o]) for o in sorted(source_terms)]
+    result = state.get('result')
+    if rescanned or result is None or state.get('translated_key') != translated_key or state.get('terms_sig') != terms_sig:
+        result = compare_renderings(source_terms, translated, terms, automata)
+        rescanned = True
+    return {"source_key": source_key, "translated_key": translated_key, "originals": originals,
+            "source_terms": source_terms, "terms_sig": terms_sig, "result": result}, rescanned
+
+def check_project_glossary(project):
+    terms = glossary_terms(project['glossary'])
+    automata = term_automata(terms)
+    previous = GLOSSARY_CHECKS.get(project['id'], {})
+    states, report, recomputed = {}, [], 0
+    for ch in project['chapters']:
+        if not ch.get('translated_text'): continue
+        states[ch['id']], changed = check_chapter(ch, terms, automata, previous.get(ch['id']))
+        recomputed += changed
+        report.append((ch, states[ch['id']]['result']))
+    # Удалённые главы выпадают из кеша вместе с проектом
+    GLOSSARY_CHECKS[project['id']] = states
+    return report, recomputed
+
+@app.get("/api/projects/{project_id}/glossary-check")
+async def glossary_check(project_id: str, only_issues: bool = True):
+    """Согласованность переводов с глоссарием по главам проекта"""
+    db = await load_db()
+    project = next((p for p in db if p['id'] == project_id), None)
+    if not project: raise HTTPException(status_code=404, detail="Project not found")
+
+    report, recomputed = await asyncio.get_running_loop().run_in_executor(None, check_project_glossary, project)
+    chapters = [{
+        "id": ch['id'],
+        "title": ch.get('title', ''),
+        "missing": r['missing'],
+        "alternative": r['alternative']
+    } for ch, r in report if not only_issues or r['missing'] or r['alternative']]
+    return {
+        "status": "ok",
+        "checked": len(report),
+        "recomputed": recomputed,
+        "missing": sum(len(r['missing']) for _, r in report),
+        "alternative": sum(len(r['alternative']) for _, r in report),
+        "chapters": chapters
+    }
+
+# --- Полнотекстовый поиск ---
+# Индекс SQLite FTS5 в search.db рядом с database.json. Все обращения к нему идут
+# через единственный поток SEARCH_EXECUTOR: обновления выполняются по порядку,
+# и поиск, пришедший после сохранения, видит новые тексты.
+# unicode61 склеивает подряд идущие иероглифы в одно слово, поэтому в индекс
+# они попадают через пробел и ищутся как фраза из отдельных символов.
+CJK_CHAR_RE = re.compile("([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ceaf])")
+CJK_RUN_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ceaf]+")
+CJK_UNSPACE_RE = re.compile("([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ceaf]\x03?) ")
+SEARCH_QUERY_RE = re.compile(r'"([^"]+)"|(\S+)')
+SNIPPET_TOKENS = 24
+SEARCH_PREFIX_MIN = 3
+SEARCH_WEIGHTS = "5.0, 1.0, 1.0"   # title, original_text, translated_text
+SEARCH_SCHEMA_VERSION = 2
+
+def cjk_spaced(text):
+    # По целому фрагменту за вызов: подстановка на каждый символ в разы медленнее
+    return CJK_RUN_RE.sub(lambda m: " ".join(m.group()) + " ", text)
+
+def search_conn():
+    global SEARCH_CONN
+    if SEARCH_CONN is None:
+        conn = sqlite3.connect(SEARCH_DB_FILE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SEARCH_SCHEMA_VERSION:
+            # Индекс строится из БД заново, старую схему проще выбросить
+            conn.execute("DROP TABLE IF EXISTS chapter_docs")
+            conn.execute("DROP TABLE IF EXISTS chapter_fts")
+        conn.execute("""CREATE TABLE IF NOT EXISTS chapter_docs (
+            id INTEGER PRIMARY KEY, project_id TEXT, chapter_id TEXT, number INTEGER, hash TEXT,
+            UNIQUE(project_id, chapter_id))""")
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS chapter_fts USING fts5(
+            title, original_text, translated_text, tokenize="unicode61 remove_diacritics 2")""")
+        # rank = взвешенный bm25: совпадение в названии важнее совпадения в тексте
+        conn.execute(f"INSERT INTO chapter_fts (chapter_fts, rank) VALUES ('rank', 'bm25({SEARCH_WEIGHTS})')")
+        conn.execute(f"PRAGMA user_version = {SEARCH_SCHEMA_VERSION}")
+        conn.commit()
+        SEARCH_CONN = conn
+    return SEARCH_CONN
+
+def search_doc(ch, number):
+    """(id, номер, название, оригинал, перевод) — снимок главы для индекса"""
+    return ch['id'], ch.get('number') or number, ch.get('title') or '', ch.get('original_text') or '', ch.get('translated_text') or ''
+
+def index_chapters(project_id, docs, full=False):
+    """Переиндексирует изменившиеся главы; с full удаляет из индекса главы, которых больше нет"""
+    conn = search_conn()
+    known = {cid: (row_id, h) for row_id, cid, h in conn.execute(
+        "SELECT id, chapter_id, hash FROM chapter_docs WHERE project_id = ?", (project_id,))}
+    with conn:
+        for cid, number, title, original, translated in docs:
+            h = hashlib.sha1("\x00".join((title, original, translated)).encode("utf-8")).hexdigest()
+            row = known.pop(cid, None)
+            if row and row[1] == h: continue
+            if row:
+                conn.execute("DELETE FROM chapter_fts WHERE rowid = ?", (row[0],))
+                conn.execute("UPDATE chapter_docs SET number = ?, hash = ? WHERE id = ?", (number, h, row[0]))
+                row_id = row[0]
+            else:
+                row_id = conn.execute("INSERT INTO chapter_docs (project_id, chapter_id, number, hash) VALUES (?, ?, ?, ?)",
+                                      (project_id, cid, number, h)).lastrowid
+            conn.execute("INSERT INTO chapter_fts (rowid, title, original_text, translated_text) VALUES (?, ?, ?, ?)",
+                         (row_id, cjk_spaced(title), cjk_spaced(original), cjk_spaced(translated)))
+        if full:
+            for row_id, _ in known.values():
+                conn.execute("DELETE FROM chapter_fts WHERE rowid = ?", (row_id,))
+                conn.execute("DELETE FROM chapter_docs WHERE id = ?", (row_id,))
+    if full: SEARCH_SYNCED.add(project_id)
+
+def schedule_index(project_id, chapters, full=False):
+    """Ставит обновление индекса в очередь, не дожидаясь его. Тексты — неизменяемые
+    строки, так что снимок дешёвый и не зависит от дальнейших правок БД. Пока
+    обновление проекта ждёт своей очереди, новые правки сливаются в него: очередь
+    не растёт, и устаревшие снимки проекта не держатся в памяти."""
+    docs = {ch['id']: search_doc(ch, i + 1 if full else 0) for i, ch in enumerate(chapters)}
+    with SEARCH_PENDING_LOCK:
+        pending = SEARCH_PENDING.get(project_id)
+        if pending is None:
+            SEARCH_PENDING[project_id] = {"full": full, "docs": docs}
+            # При ошибке обновление уже снято с очереди: следующий поиск переиндексирует проект целиком
+            SEARCH_EXECUTOR.submit(flush_index, project_id).add_done_callback(
+                log_failure(project_id, "Ошибка обновления поискового индекса",
+                            lambda: SEARCH_SYNCED.discard(project_id)))
+        elif full:
+            pending.update(full=True, docs=docs)
+        else:
+            pending["docs"].update(docs)
+
+def flush_index(project_id):
+    with SEARCH_PENDING_LOCK:
+        pending = SEARCH_PENDING.pop(project_id)
+    index_chapters(project_id, list(pending["docs"].values()), pending["full"])
+
+def fts_phrase(text):
+    tokens = WORD_RE.findall(cjk_spaced(text))
+    return '"' + " ".join(tokens) + '"' if tokens else None
+
+def fts_query(q, field):
+    """Запрос пользователя → выражение FTS5. Слова от SEARCH_PREFIX_MIN букв ищутся
+    по префиксу (падежи), "фраза в кавычках" и иероглифы — как фраза."""
+    parts = []
+    for quoted, word in SEARCH_QUERY_RE.findall(q):
+        phrase = fts_phrase(quoted or word)
+        if not phrase: continue
+        if quoted or " " in phrase or CJK_CHAR_RE.search(word) or len(word) < SEARCH_PREFIX_MIN:
+            parts.append(phrase)
+        else:
+            parts.append(phrase + "*")
+    if not parts: return None
+    columns = {"original": "original_text", "translated": "translated_text"}.get(field, "{title original_text translated_text}")
+    return f"{columns} : ({' '.join(parts)})"
+
+def search_snippet(snippet):
+    """Фрагмент FTS5 → безопасный HTML с <mark> вокруг совпадений"""
+    snippet = CJK_UNSPACE_RE.sub(r"\1", snippet)
+    return html.escape(snippet).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+def search_chapters(project_id, query, limit, offset):
+    conn = search_conn()
+    # Проект отбирается по chapter_docs: id проекта не токенизируется и не путается с похожими
+    where = "chapter_fts MATCH ? AND d.project_id = ?"
+    total = conn.execute(f"SELECT count(*) FROM chapter_fts JOIN chapter_docs d ON d.id = chapter_fts.rowid WHERE {where}",
+                         (query, project_id)).fetchone()[0]
+    rows = conn.execute(f"""
+        SELECT d.chapter_id, d.number, chapter_fts.title, rank,
+               snippet(chapter_fts, 1, char(2), char(3), '…', {SNIPPET_TOKENS}),
+               snippet(chapter_fts, 2, char(2), char(3), '…', {SNIPPET_TOKENS})
+        FROM chapter_fts JOIN chapter_docs d ON d.id = chapter_fts.rowid
+        WHERE {where} ORDER BY rank LIMIT ? OFFSET ?""", (query, project_id, limit, offset)).fetchall()
+    hits = [{
+        "id": cid,
+        "number": number,
+        "title": CJK_UNSPACE_RE.sub(r"\1", title),
+        "score": round(-score, 4),
+        "original_snippet": search_snippet(orig) if "\x02" in orig else None,
+        "translated_snippet": search_snippet(tr) if "\x02" in tr else None
+    } for cid, number, title, score, orig, tr in rows]
+    return total, hits
+
+@app.get("/api/projects/{project_id}/search")
+async def search_project(project_id: str, q: str, field: str = "all", limit: int = 20, offset: int = 0):
+    """Поиск по оригиналу и переводу глав: ранжирование bm25, постранично, с подсветкой.
+    field: all, original или translated."""
+    query = fts_query(q, field)
+    if not query: raise HTTPException(status_code=400, detail="Empty query")
+    limit, offset = max(1, min(limit, 100)), max(0, offset)
+    started = time.perf_counter()
+    if project_id not in SEARCH_SYNCED:
+        # Первый поиск после запуска: досверяем индекс с БД по хэшам глав
+        db = await load_db()
+        project = next((p for p in db if p['id'] == project_id), None)
+        if not project: raise HTTPException(status_code=404, detail="Project not found")
+        schedule_index(project_id, project['chapters'], full=True)
+    try:
+        total, hits = await asyncio.get_running_loop().run_in_executor(SEARCH_EXECUTOR, search_chapters, project_id, query, limit, offset)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Bad query: {e}")
+    return {
+        "status": "ok",
+        "query": q,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "hits": hits
+    }
+
+# --- История правок глав ---
+# Ревизии translated_text лежат в history.db, а не в database.json: GET /api/projects
+# не раздувается, а save_project с клиента их не затирает. Каждая ревизия — дельта
+# по строкам к предыдущей (zlib), раз в HISTORY_SNAPSHOT_EVERY ревизий — полный
+# снимок, так что восстановление любой ревизии читает не больше десятка записей.
+# Если дельта выходит не меньше снимка (перевод сгенерирован заново), пишется снимок.
+def history_conn():
+    global HISTORY_CONN
+    if HISTORY_CONN is None:
+        conn = sqlite3.connect(HISTORY_DB_FILE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS revisions (
+            id INTEGER PRIMARY KEY, project_id TEXT, chapter_id TEXT, rev INTEGER, base INTEGER,
+            kind TEXT, source TEXT, created_at TEXT, size INTEGER, text_hash TEXT, data BLOB,
+            UNIQUE(project_id, chapter_id, rev))""")
+        HISTORY_CONN = conn
+    return HISTORY_CONN
+
+def make_delta(old, new):
+    """Операции по строкам: [начало, конец] — строки старого текста, str — новые строки"""
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal": ops.append([i1, i2])
+        elif j2 > j1: ops.append("".join(b[j1:j2]))
+    return ops
+
+def apply_delta(old, ops):
+    a = old.splitlines(keepends=True)
+    return "".join("".join(a[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+def revision_text(project_id, chapter_id, rev, conn=None):
+    """Текст ревизии: ближайший снимок и дельты после него"""
+    conn = conn or history_conn()
+    row = conn.execute("SELECT base FROM revisions WHERE project_id = ? AND chapter_id = ? AND rev = ?",
+                       (project_id, chapter_id, rev)).fetchone()
+    if not row: return None
+    text = ""
+    for kind, data in conn.execute(
+            "SELECT kind, data FROM revisions WHERE project_id = ? AND chapter_id = ? AND rev BETWEEN ? AND ? ORDER BY rev",
+            (project_id, chapter_id, row[0], rev)):
+        data = zlib.decompress(data)
+        text = data.decode("utf-8") if kind == "snapshot" else apply_delta(text, loads(data))
+    return text
+
+def record_revisions(project_id, changes, source):
+    """changes: [(id главы, прежний текст, новый текст)]. Прежний текст главы без
+    истории сохраняется первой ревизией, чтобы первая же перезапись его не потеряла."""
+    conn = history_conn()
+    created_at = datetime.datetime.now().isoformat(timespec="seconds")
+    with conn:
+        for chapter_id, old, new in changes:
+            last = conn.execute(
+                "SELECT rev, base, text_hash FROM revisions WHERE project_id = ? AND chapter_id = ? ORDER BY rev DESC LIMIT 1",
+                (project_id, chapter_id)).fetchone()
+            old_hash = hashlib.sha1(old.encode("utf-8")).hexdigest()
+            if last is None and old:
+                conn.execute("INSERT INTO revisions (project_id, chapter_id, rev, base, kind, source, created_at, size, text_hash, data) "
+                             "VALUES (?, ?, 1, 1, 'snapshot', 'initial', ?, ?, ?, ?)",
+                             (project_id, chapter_id, created_at, len(old.encode("utf-8")), old_hash, zlib.compress(old.encode("utf-8"), 9)))
+                last = (1, 1, old_hash)
+            new_raw = new.encode("utf-8")
+            new_hash = hashlib.sha1(new_raw).hexdigest()
+            if last and last[2] == new_hash: continue
+
+            rev = last[0] + 1 if last else 1
+            kind, base, data = "snapshot", rev, zlib.compress(new_raw, 9)
+            if last and rev - last[1] < HISTORY_SNAPSHOT_EVERY:
+                prev = old if last[2] == old_hash else revision_text(project_id, chapter_id, last[0], conn)
+                delta = zlib.compress(dumps(make_delta(prev, new)), 9)
+                if len(delta) < len(data):
+                    kind, base, data = "delta", last[1], delta
+            conn.execute("INSERT INTO revisions (project_id, chapter_id, rev, base, kind, source, created_at, size, text_hash, data) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (project_id, chapter_id, rev, base, kind, source, created_at, len(new_raw), new_hash, data))
+
+def translation_changes(old_chapters, new_chapters):
+    old_texts = {ch['id']: ch.get('translated_text') or '' for ch in old_chapters}
+    changes = []
+    for ch in new_chapters:
+        old, new = old_texts.get(ch['id'], ''), ch.get('translated_text') or ''
+        if old != new: changes.append((ch['id'], old, new))
+    return changes
+
+def schedule_revisions(project_id, changes, source):
+    if changes:
+        HISTORY_EXECUTOR.submit(record_revisions, project_id, changes, source).add_done_callback(
+            log_failure(project_id, "Ошибка записи истории правок"))
+
+async def run_history(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(HISTORY_EXECUTOR, fn, *args)
+
+def list_revisions(project_id, chapter_id):
+    rows = history_conn().execute(
+        "SELECT rev, kind, source, created_at, size, length(data) FROM revisions "
+        "WHERE project_id = ? AND chapter_id = ? ORDER BY rev DESC", (project_id, chapter_id)).fetchall()
+    return [{"rev": rev, "kind": kind, "source": source, "created_at": created_at, "size": size, "stored": stored}
+            for rev, kind, source, created_at, size, stored in rows]
+
+def diff_revisions(project_id, chapter_id, from_rev, to_rev, context):
+    conn = history_conn()
+    if to_rev is None:
+        row = conn.execute("SELECT max(rev) FROM revisions WHERE project_id = ? AND chapter_id = ?",
+                           (project_id, chapter_id)).fetchone()
+        to_rev = row[0]
+    if from_rev is None and to_rev: from_rev = to_rev - 1
+    # r0 — пустой текст до первой ревизии, чтобы у главы с одной ревизией тоже был дифф
+    a = "" if from_rev == 0 else revision_text(project_id, chapter_id, from_rev, conn) if from_rev else None
+    b = revision_text(project_id, chapter_id, to_rev, conn) if to_rev else None
+    if a is None or b is None: return None
+    diff = difflib.unified_diff(a.splitlines(), b.splitlines(),
+                                fromfile=f"r{from_rev}", tofile=f"r{to_rev}", n=context, lineterm="")
+    return {"from_rev": from_rev, "to_rev": to_rev, "diff": "\n".join(diff)}
+
+def history_stats(project_id):
+    conn = history_conn()
+    revisions, chapters, size, stored, snapshots = conn.execute(
+        "SELECT count(*), count(DISTINCT chapter_id), coalesce(sum(size), 0), coalesce(sum(length(data)), 0), "
+        "coalesce(sum(kind = 'snapshot'), 0) FROM revisions WHERE project_id = ?", (project_id,)).fetchone()
+    file_size = sum(os.path.getsize(f) for f in (HISTORY_DB_FILE, HISTORY_DB_FILE + "-wal") if os.path.exists(f))
+    return {
+        "revisions": revisions,
+        "chapters": chapters,
+        "snapshots": snapshots,
+        "deltas": revisions - snapshots,
+        "full_copies_bytes": size,
+        "stored_bytes": stored,
+        "ratio": round(stored / size, 4) if size else 0,
+        "history_db_bytes": file_size
+    }
+
+@app.get("/api/projects/{project_id}/chapters/{chapter_id}/revisions")
+async def get_revisions(project_id: str, chapter_id: str):
+    """Ревизии перевода главы, новые сверху"""
+    return await run_history(list_revisions, project_id, chapter_id)
+
+@app.get("/api/projects/{project_id}/chapters/{chapter_id}/revisions/diff")
+async def get_revision_diff(project_id: str, chapter_id: str, from_rev: Optional[int] = None,
+                            to_rev: Optional[int] = None, context: int = 3):
+    """unified diff между ревизиями; по умолчанию — последняя правка"""
+    result = await run_history(diff_revisions, project_id, chapter_id, from_rev, to_rev, context)
+    if result is None: raise HTTPException(status_code=404, detail="Revision not found")
+    return result
+
+@app.post("/api/projects/{project_id}/chapters/{chapter_id}/revisions/{rev}/restore")
+async def restore_revision(project_id: str, chapter_id: str, rev: int):
+    """Возвращает перевод главы к ревизии; восстановление само становится новой ревизией"""
+    text = await run_history(revision_text, project_id, chapter_id, rev)
+    if text is None: raise HTTPException(status_code=404, detail="Revision not found")
+    async with DB_LOCK:
+        db = await load_db()
+        project = next((p for p in db if p['id'] == project_id), None)
+        ch = next((c for c in project['chapters'] if c['id'] == chapter_id), None) if project else None
+        if not ch: raise HTTPException(status_code=404, detail="Chapter not found")
+        old = ch.get('translated_text') or ''
+        ch['translated_text'] = text
+        await save_db(db)
+    schedule_revisions(project_id, [(chapter_id, old, text)], "restore")
+    schedule_index(project_id, [ch])
+    add_log(project_id, f"Глава {ch.get('title', chapter_id)}: перевод восстановлен из ревизии {rev}.", "info")
+    return {"status": "restored", "rev": rev}
+
+@app.get("/api/projects/{project_id}/revisions/stats")
+async def get_history_stats(project_id: str):
+    """Сколько места занимает история по сравнению с полными копиями каждой ревизии"""
+    return await run_history(history_stats, project_id)
+
 # --- API настроек Rulate ---
 @app.get("/api/rulate/settings/{project_id}")
-def get_rulate_settings(project_id: str):
-    db = load_db()
+async def get_rulate_settings(project_id: str):
+    db = await load_db()
     for p in db:
         if p['id'] == project_id:
             return p.get('rulate_settings', {
@@ -130,75 +1533,96 @@ def get_rulate_settings(project_id: str):
     return {"error": "Project not found"}
 
 @app.post("/api/rulate/settings")
-def save_rulate_settings(req: RulateSettingsRequest):
-    db = load_db()
-    for p in db:
-        if p['id'] == req.project_id:
-            p['rulate_settings'] = {
-                "book_url": req.book_url,
-                "chapter_status": req.chapter_status,
-                "delayed_chapter": req.delayed_chapter,
-                "subscription_only": req.subscription_only,
-                "add_as_translation": req.add_as_translation
-            }
-            save_db(db)
-            add_log(req.project_id, f"Настройки Rulate сохранены", "success")
-            return {"status": "saved"}
+async def save_rulate_settings(req: RulateSettingsRequest):
+    async with DB_LOCK:
+        db = await load_db()
+        for p in db:
+            if p['id'] == req.project_id:
+                p['rulate_settings'] = {
+                    "book_url": req.book_url,
+                    "chapter_status": req.chapter_status,
+                    "delayed_chapter": req.delayed_chapter,
+                    "subscription_only": req.subscription_only,
+                    "add_as_translation": req.add_as_translation
+                }
+                await save_db(db)
+                add_log(req.project_id, f"Настройки Rulate сохранены", "success")
+                return {"status": "saved"}
     return {"status": "error", "msg": "Project not found"}
 
 # --- API перевода ---
 @app.post("/api/translate/send")
-def send_job(job: dict):
-    db = load_db()
-    project = next((p for p in db if p['id'] == job['project_id']), None)
-    if not project: return {"status": "error"}
+async def send_job(job: dict):
+    started = time.time()
+    chapter_ids = set(job['chapter_ids'])
+    async with DB_LOCK:
+        db = await load_db()
+        project = next((p for p in db if p['id'] == job['project_id']), None)
+        if not project: return {"status": "error"}
 
-    for ch in project['chapters']:
-        if ch['id'] in job['chapter_ids']:
-            ch['status'] = 'translating'
-    save_db(db)
+        for ch in project['chapters']:
+            if ch['id'] in chapter_ids:
+                ch['status'] = 'translating'
+        await save_db(db)
+        # Копии: задача в очереди не должна меняться вместе с БД
+        chapters = [dict(c) for c in project['chapters'] if c['id'] in chapter_ids]
+        glossary = [dict(g) for g in project['glossary']]
     
     batch = []
-    chapters = [c for c in project['chapters'] if c['id'] in job['chapter_ids']]
+    batches = []
     batch_size = job.get('batch_size', 5)
     
     for c in chapters:
         batch.append(c)
         if len(batch) >= batch_size:
-            JOB_QUEUE.append({"type":"translate", "pid":job['project_id'], "prompt":job['system_prompt'], "glossary":project['glossary'], "chapters":batch})
+            batches.append(batch)
             batch = []
     if batch:
-        JOB_QUEUE.append({"type":"translate", "pid":job['project_id'], "prompt":job['system_prompt'], "glossary":project['glossary'], "chapters":batch})
+        batches.append(batch)
+
+    enqueued_at = time.time()
+    for batch in batches:
+        trace_id = new_trace(job['project_id'], "translate")
+        add_span(trace_id, "send_job", started, enqueued_at, meta={"chapters": len(batch)})
+        JOB_QUEUE.append({"type":"translate", "pid":job['project_id'], "prompt":job['system_prompt'], "glossary":glossary, "chapters":batch, "trace_id":trace_id, "enqueued_at":enqueued_at})
         
     add_log(job['project_id'], f"В очередь добавлено {len(chapters)} глав.", "info")
     return {"status": "queued"}
 
 # --- API публикации на Rulate ---
 @app.post("/api/publish/send")
-def send_publish_job(req: PublishJobRequest):
-    db = load_db()
+async def send_publish_job(req: PublishJobRequest):
+    started = time.time()
+    chapter_ids = set(req.chapter_ids)
     chapters_to_publish = []
     
-    for p in db:
-        if p['id'] == req.project_id:
-            for ch in p['chapters']:
-                if ch['id'] in req.chapter_ids:
-                    ch['status'] = 'publishing'
-                    chapters_to_publish.append({
-                        "id": ch['id'],
-                        "number": ch.get('number', 0),
-                        "title": ch['title'],
-                        "translated_text": ch.get('translated_text', '')
-                    })
-            save_db(db)
-            break
+    async with DB_LOCK:
+        db = await load_db()
+        for p in db:
+            if p['id'] == req.project_id:
+                for ch in p['chapters']:
+                    if ch['id'] in chapter_ids:
+                        ch['status'] = 'publishing'
+                        chapters_to_publish.append({
+                            "id": ch['id'],
+                            "number": ch.get('number', 0),
+                            "title": ch['title'],
+                            "translated_text": ch.get('translated_text', '')
+                        })
+                await save_db(db)
+                break
     
     if not chapters_to_publish:
         return {"status": "error", "msg": "No chapters found"}
     
+    trace_id = new_trace(req.project_id, "publish")
+    enqueued_at = time.time()
+    add_span(trace_id, "send_job", started, enqueued_at, meta={"chapters": len(chapters_to_publish)})
     PUBLISH_QUEUE.append({
         "type": "publish",
         "project_id": req.project_id,
+        "trace_id": trace_id,
+        "enqueued_at": enqueued_at,
         "book_url": req.book_url,
         "settings": {
             "chapter_status": req.chapter_status,
@@ -213,56 +1637,90 @@ def send_publish_job(req: PublishJobRequest):
     return {"status": "queued", "count": len(chapters_to_publish)}
 
 @app.get("/api/publish/status/{project_id}")
-def get_publish_status(project_id: str):
+async def get_publish_status(project_id: str):
     pending = [j for j in PUBLISH_QUEUE if j.get("project_id") == project_id]
     return {"pending_jobs": len(pending), "total_queue": len(PUBLISH_QUEUE)}
 
 # --- Agent API ---
 @app.get("/agent-api/get-job")
-def get_job():
+async def get_job():
     # Приоритет: публикация, потом перевод
     if PUBLISH_QUEUE:
-        return PUBLISH_QUEUE.pop(0)
-    if JOB_QUEUE:
-        return JOB_QUEUE.pop(0)
-    return {"type": "empty"}
+        job = PUBLISH_QUEUE.pop(0)
+    elif JOB_QUEUE:
+        job = JOB_QUEUE.pop(0)
+    else:
+        return {"type": "empty"}
+    if job.get("trace_id"):
+        add_span(job["trace_id"], "queue_wait", job.get("enqueued_at", time.time()), time.time())
+    return job
 
 @app.post("/agent-api/submit-job")
-def submit_job(res: dict):
-    db = load_db()
+async def submit_job(res: dict):
+    started = time.time()
     job_type = res.get("type", "translate")
-    
-    if job_type == "translate":
-        for p in db:
-            if p['id'] == res['project_id']:
-                for item in res['results']:
-                    for ch in p['chapters']:
-                        if ch['id'] == item['id']:
+    trace_id = res.get("trace_id")
+    if trace_id:
+        add_agent_spans(trace_id, res.get("spans"), pid=res.get("project_id"), kind=job_type)
+
+    async with DB_LOCK:
+        db = await load_db()
+        if job_type == "translate":
+            for p in db:
+                if p['id'] == res['project_id']:
+                    by_id = {ch['id']: ch for ch in p['chapters']}
+                    updated, changes = [], []
+                    for item in res['results']:
+                        ch = by_id.get(item['id'])
+                        if ch:
+                            changes.append((ch['id'], ch.get('translated_text') or '', item['translated_text']))
                             ch['translated_text'] = item['translated_text']
                             ch['status'] = 'completed'
-                save_db(db)
-                add_log(res['project_id'], f"Готов перевод: {len(res['results'])} глав.", "success")
-                return {"status":"ok"}
-    
-    elif job_type == "publish":
-        for p in db:
-            if p['id'] == res.get('project_id'):
-                for ch in p['chapters']:
-                    if ch['id'] == res.get('chapter_id'):
-                        if res.get('success'):
-                            ch['status'] = 'published'
-                            ch['rulate_chapter_id'] = res.get('rulate_chapter_id')
-                            add_log(res['project_id'], f"Опубликовано: {ch['title']}", "success")
-                        else:
-                            ch['status'] = 'completed'
-                            add_log(res['project_id'], f"Ошибка публикации: {ch['title']} - {res.get('error')}", "error")
-                save_db(db)
-                return {"status": "ok"}
+                            updated.append(ch)
+                    await save_db(db)
+                    schedule_revisions(p['id'], changes, "agent")
+                    schedule_index(p['id'], updated)
+                    add_span(trace_id, "submit_job", started, time.time(), meta={"chapters": len(res['results'])})
+                    add_log(res['project_id'], f"Готов перевод: {len(res['results'])} глав.", "success")
+                    return {"status":"ok"}
     
+        elif job_type == "publish":
+            for p in db:
+                if p['id'] == res.get('project_id'):
+                    for ch in p['chapters']:
+                        if ch['id'] == res.get('chapter_id'):
+                            if res.get('success'):
+                                ch['status'] = 'published'
+                                ch['rulate_chapter_id'] = res.get('rulate_chapter_id')
+                                add_log(res['project_id'], f"Опубликовано: {ch['title']}", "success")
+                            else:
+                                ch['status'] = 'completed'
+                                add_log(res['project_id'], f"Ошибка публикации: {ch['title']} - {res.get('error')}", "error")
+                    await save_db(db)
+                    add_span(trace_id, "submit_job", started, time.time(), meta={"chapter_id": res.get('chapter_id')})
+                    return {"status": "ok"}
+
     return {"status":"error"}
 
+# --- API трассировки ---
+@app.get("/api/traces/job/{trace_id}")
+async def get_trace(trace_id: str):
+    """Водопад этапов одной задачи"""
+    trace = TRACES.get(trace_id)
+    if not trace: raise HTTPException(status_code=404, detail="Trace not found")
+    return trace_waterfall(trace)
+
+@app.get("/api/traces/{project_id}")
+async def get_project_traces(project_id: str, limit: int = 50):
+    """Последние задачи проекта и сводка по этапам"""
+    traces = [t for t in TRACES.values() if t['pid'] == project_id]
+    return {
+        "jobs": [trace_waterfall(t) for t in traces[-limit:]],
+        "stages": stage_breakdown(traces)
+    }
+
 @app.get("/api/health")
-def health_check():
+async def health_check():
     return {"status": "ok", "queues": {"translate": len(JOB_QUEUE), "publish": len(PUBLISH_QUEUE)}}
 
 if __name__ == "__main__":
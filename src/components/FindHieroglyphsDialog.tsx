@@ -3,6 +3,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from './ui/dialog';
 import { Button } from './ui/button';
 import { AlertTriangle, Loader2, X } from 'lucide-react';
 import { Chapter } from '@/types';
+import { scanHieroglyphs } from '@/lib/api';
 
 interface ChapterResult {
   chapterId: string;
@@ -17,17 +18,25 @@ interface ChapterResult {
 interface FindHieroglyphsDialogProps {
   open: boolean;
   onOpenChange: (open: boolean) => void;
+  projectId?: string;
   selectedChapters: string[];
   chapters: Chapter[];
   onChaptersWithHieroglyphsFound: (chapterIds: string[]) => void;
 }
 
+// sha1 в hex — тем же хэшем сервер помечает просканированные тексты
+async function sha1Hex(text: string): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-1', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
 // Регулярка для поиска китайских иероглифов
 const CHINESE_REGEX = /[\u4e00-\u9fff\u3400-\u4dbf\u{20000}-\u{2a6df}\u{2a700}-\u{2b73f}\u{2b740}-\u{2b81f}\u{2b820}-\u{2ceaf}]/gu;
 
 export function FindHieroglyphsDialog({ 
   open, 
   onOpenChange, 
+  projectId,
   selectedChapters,
   chapters,
   onChaptersWithHieroglyphsFound,
@@ -44,9 +53,49 @@ export function FindHieroglyphsDialog({
     }
   }, [open]);
 
-  const findHieroglyphs = () => {
+  // Поиск на сервере: тексты глав не грузятся в браузер, повторный поиск
+  // пересканирует только изменившиеся главы. Возвращает null, если сервер сканировал
+  // не те тексты, что открыты здесь (правки не сохранены или глав на сервере нет), —
+  // тогда ищем по локальным данным
+  const findHieroglyphsOnServer = async (projectId: string): Promise<ChapterResult[] | null> => {
+    const scan = await scanHieroglyphs(projectId, { chapterIds: selectedChapters });
+    const selected = chapters.filter(c => selectedChapters.includes(c.id));
+    for (const chapter of selected) {
+      const local = chapter.translatedText ? await sha1Hex(chapter.translatedText) : undefined;
+      if (scan.hashes?.[chapter.id] !== local) return null;
+    }
+    return scan.chapters.map((ch): ChapterResult => {
+      // Как и в локальном поиске: по одному примеру на каждый иероглиф
+      const seen = new Set<string>();
+      const matches: ChapterResult['matches'] = [];
+      for (const m of ch.matches) {
+        for (const char of m.text) {
+          if (seen.has(char)) continue;
+          seen.add(char);
+          matches.push({ text: char, context: `...${m.context}...` });
+        }
+      }
+      return { chapterId: ch.id, chapterTitle: ch.title, matchCount: ch.unique, matches };
+    });
+  };
+
+  const findHieroglyphs = async () => {
     setIsSearching(true);
     setHasSearched(true);
+
+    if (projectId) {
+      try {
+        const foundResults = await findHieroglyphsOnServer(projectId);
+        if (foundResults) {
+          setResults(foundResults);
+          onChaptersWithHieroglyphsFound(foundResults.map((r) => r.chapterId));
+          setIsSearching(false);
+          return;
+        }
+      } catch {
+        // Сервер недоступен — ищем локально
+      }
+    }
     
     const foundResults: ChapterResult[] = [];
     const chaptersWithHieroglyphs: string[] = [];
@@ -164,9 +213,9 @@ export function FindHieroglyphsDialog({
                         <span className="text-destructive font-bold text-lg ml-4">{match.text}</span>
                       </div>
                     ))}
-                    {result.matches.length > 5 && (
+                    {result.matchCount > 5 && (
                       <div className="p-2 text-center text-sm text-muted-foreground">
-                        ... и ещё {result.matches.length - 5} иероглифов
+                        ... и ещё {result.matchCount - 5} иероглифов
                       </div>
                     )}
                   </div>
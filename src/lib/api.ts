@@ -61,12 +61,29 @@ export async function getProjects(): Promise<ApiProject[]> {
   return res.json();
 }
 
+// Тела от этого размера сервер принимает сжатыми (Content-Encoding: gzip)
+const COMPRESS_MIN_SIZE = 1024;
+
+// JSON-тело запроса: крупное сжимается gzip, если браузер умеет CompressionStream
+async function jsonBody(data: unknown): Promise<{ body: BodyInit; headers: Record<string, string> }> {
+  const json = JSON.stringify(data);
+  if (json.length < COMPRESS_MIN_SIZE || typeof CompressionStream === 'undefined') {
+    return { body: json, headers: { 'Content-Type': 'application/json' } };
+  }
+  const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+  return {
+    body: await new Response(stream).blob(),
+    headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' },
+  };
+}
+
 // Сохранить проект
 export async function saveProject(project: ApiProject): Promise<{ status: string }> {
+  const { body, headers } = await jsonBody(project);
   const res = await fetch(`${API_BASE}/api/projects/save`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify(project),
+    headers,
+    body,
   });
   if (!res.ok) throw new Error('Failed to save project');
   return res.json();
@@ -272,3 +289,238 @@ export async function getPublishStatus(projectId: string): Promise<{ pending_job
   }
   return { pending_jobs: 0, total_queue: 0 };
 }
+
+// Клиенты импорта, экспорта, проверки глоссария, поиска и ревизий пока не подключены к UI:
+// ProjectDetailPage работает на mockData, и на сервере нет проектов, с которыми он мог бы
+// их вызвать. Подключать вместе с переводом страницы проекта на getProjects/saveProject.
+
+// === Ingest API ===
+
+export interface IngestProgress {
+  ingest_id: string;
+  project_id: string;
+  format: 'ndjson' | 'multipart' | 'zip';
+  status: 'running' | 'done' | 'error';
+  received: number;
+  added: number;
+  duplicates: number;
+  invalid: number;
+  errors: { record?: number; error: string }[];
+}
+
+// Потоковый импорт глав: TXT-файлы (главы режутся по 第X章 на сервере) или ZIP
+export async function ingestChapterFiles(
+  projectId: string,
+  files: File[],
+  ingestId?: string
+): Promise<IngestProgress> {
+  const query = ingestId ? `?ingest_id=${encodeURIComponent(ingestId)}` : '';
+  const isZip = files.length === 1 && files[0].name.toLowerCase().endsWith('.zip');
+  let init: RequestInit;
+  if (isZip) {
+    init = { method: 'POST', headers: { 'Content-Type': 'application/zip' }, body: files[0] };
+  } else {
+    const form = new FormData();
+    files.forEach((f) => form.append('files', f, f.name));
+    init = { method: 'POST', body: form };
+  }
+  const res = await fetch(`${API_BASE}/api/projects/${projectId}/ingest${query}`, init);
+  if (!res.ok) throw new Error(`Failed to ingest chapters: ${await res.text()}`);
+  return res.json();
+}
+
+export async function getIngestProgress(ingestId: string): Promise<IngestProgress | null> {
+  const res = await fetch(`${API_BASE}/api/ingest/${ingestId}`);
+  if (!res.ok) return null;
+  return res.json();
+}
+
+// === Export API ===
+
+export interface ExportOptions {
+  format: 'epub' | 'zip' | 'txt';
+  content?: 'md' | 'html';
+  chapterFrom?: number;
+  chapterTo?: number;
+  status?: string[] | 'all';
+}
+
+// Ссылка на скачивание: файл формируется сервером потоково, браузер качает его сам
+export function getProjectExportUrl(projectId: string, options: ExportOptions): string {
+  const params = new URLSearchParams({ format: options.format });
+  if (options.content) params.set('content', options.content);
+  if (options.chapterFrom !== undefined) params.set('chapter_from', String(options.chapterFrom));
+  if (options.chapterTo !== undefined) params.set('chapter_to', String(options.chapterTo));
+  if (options.status) params.set('status', options.status === 'all' ? 'all' : options.status.join(','));
+  return `${API_BASE}/api/projects/${projectId}/export?${params}`;
+}
+
+// === Hieroglyphs API ===
+
+export interface HieroglyphMatch {
+  offset: number;
+  length: number;
+  text: string;
+  context_offset: number;
+  context: string;
+}
+
+export interface HieroglyphChapterResult {
+  id: string;
+  title: string;
+  count: number;
+  unique: number;
+  fragments: number;
+  matches: HieroglyphMatch[];
+}
+
+export interface HieroglyphScanResult {
+  status: string;
+  scanned: number;
+  rescanned: number;
+  hashes: Record<string, string>; // id главы -> sha1 просканированного translated_text
+  total_matches: number;
+  chapters: HieroglyphChapterResult[];
+  requeued: number;
+}
+
+// Поиск непереведённых иероглифов на сервере; смещения — в кодовых точках Python.
+// С requeue главы с иероглифами сразу уходят на повторный перевод
+export async function scanHieroglyphs(
+  projectId: string,
+  options: { chapterIds?: string[]; maxMatches?: number; requeue?: boolean; systemPrompt?: string; batchSize?: number } = {}
+): Promise<HieroglyphScanResult> {
+  const res = await fetch(`${API_BASE}/api/hieroglyphs/scan`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      project_id: projectId,
+      chapter_ids: options.chapterIds,
+      max_matches: options.maxMatches,
+      requeue: options.requeue,
+      system_prompt: options.systemPrompt,
+      batch_size: options.batchSize,
+    }),
+  });
+  if (!res.ok) throw new Error(`Failed to scan hieroglyphs: ${await res.text()}`);
+  return res.json();
+}
+
+// === Glossary check API ===
+
+export interface GlossaryIssue {
+  original: string;
+  expected: string;
+  occurrences: number;
+  found?: string[];
+  expected_found?: boolean;
+}
+
+export interface GlossaryCheckResult {
+  status: string;
+  checked: number;
+  recomputed: number;
+  missing: number;
+  alternative: number;
+  chapters: { id: string; title: string; missing: GlossaryIssue[]; alternative: GlossaryIssue[] }[];
+}
+
+// Термины из оригинала, которых нет в переводе главы или которые переведены альтернативным вариантом
+export async function checkGlossaryConsistency(projectId: string, onlyIssues = true): Promise<GlossaryCheckResult> {
+  const res = await fetch(`${API_BASE}/api/projects/${projectId}/glossary-check?only_issues=${onlyIssues}`);
+  if (!res.ok) throw new Error('Failed to check glossary');
+  return res.json();
+}
+
+// === Search API ===
+
+export interface SearchHit {
+  id: string;
+  number: number;
+  title: string;
+  score: number;
+  original_snippet: string | null;   // HTML: текст экранирован, совпадения в <mark>
+  translated_snippet: string | null;
+}
+
+export interface SearchResult {
+  status: string;
+  query: string;
+  total: number;
+  limit: number;
+  offset: number;
+  took_ms: number;
+  hits: SearchHit[];
+}
+
+// Полнотекстовый поиск по главам проекта: "фраза в кавычках", слова ищутся по началу
+export async function searchChapters(
+  projectId: string,
+  query: string,
+  options: { field?: 'all' | 'original' | 'translated'; limit?: number; offset?: number } = {}
+): Promise<SearchResult> {
+  const params = new URLSearchParams({ q: query, field: options.field || 'all' });
+  if (options.limit !== undefined) params.set('limit', String(options.limit));
+  if (options.offset !== undefined) params.set('offset', String(options.offset));
+  const res = await fetch(`${API_BASE}/api/projects/${projectId}/search?${params}`);
+  if (!res.ok) throw new Error(`Failed to search: ${await res.text()}`);
+  return res.json();
+}
+
+// === Revisions API ===
+
+export interface ChapterRevision {
+  rev: number;
+  kind: 'snapshot' | 'delta';
+  source: 'initial' | 'editor' | 'agent' | 'restore';
+  created_at: string;
+  size: number;
+  stored: number;
+}
+
+export interface HistoryStats {
+  revisions: number;
+  chapters: number;
+  snapshots: number;
+  deltas: number;
+  full_copies_bytes: number;
+  stored_bytes: number;
+  ratio: number;
+  history_db_bytes: number;
+}
+
+const revisionsUrl = (projectId: string, chapterId: string) =>
+  `${API_BASE}/api/projects/${projectId}/chapters/${encodeURIComponent(chapterId)}/revisions`;
+
+export async function getChapterRevisions(projectId: string, chapterId: string): Promise<ChapterRevision[]> {
+  const res = await fetch(revisionsUrl(projectId, chapterId));
+  if (!res.ok) throw new Error('Failed to fetch revisions');
+  return res.json();
+}
+
+// unified diff между ревизиями; без параметров — последняя правка
+export async function getRevisionDiff(
+  projectId: string,
+  chapterId: string,
+  fromRev?: number,
+  toRev?: number
+): Promise<{ from_rev: number; to_rev: number; diff: string } | null> {
+  const params = new URLSearchParams();
+  if (fromRev !== undefined) params.set('from_rev', String(fromRev));
+  if (toRev !== undefined) params.set('to_rev', String(toRev));
+  const res = await fetch(`${revisionsUrl(projectId, chapterId)}/diff?${params}`);
+  if (!res.ok) return null;
+  return res.json();
+}
+
+export async function restoreRevision(projectId: string, chapterId: string, rev: number): Promise<{ status: string; rev: number }> {
+  const res = await fetch(`${revisionsUrl(projectId, chapterId)}/${rev}/restore`, { method: 'POST' });
+  if (!res.ok) throw new Error('Failed to restore revision');
+  return res.json();
+}
+
+export async function getHistoryStats(projectId: string): Promise<HistoryStats> {
+  const res = await fetch(`${API_BASE}/api/projects/${projectId}/revisions/stats`);
+  if (!res.ok) throw new Error('Failed to fetch history stats');
+  return res.json();
+}
@@ -479,6 +479,7 @@ export default function ProjectDetailPage() {
         <FindHieroglyphsDialog
           open={isFindHieroglyphsOpen}
           onOpenChange={setIsFindHieroglyphsOpen}
+          projectId={id}
           selectedChapters={selectedChapters}
           chapters={chapters}
           onChaptersWithHieroglyphsFound={setChaptersWithHieroglyphs}
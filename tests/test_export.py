@@ -0,0 +1,42 @@
+import io
+import os
+import sys
+import uuid
+import xml.etree.ElementTree as ET
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public"))
+
+from server import export_epub, export_zip, markdown_to_html
+
+# Разметка, которую выдают runs_to_markdown (агент) и markdownify (старый путь)
+CHAPTERS = [
+    {"title": "Глава 1", "text": "Он ***стоять*** тут.\n\n**жирный** и *курсив*, a \\* b \\_c\\_"},
+    {"title": "Глава 2 <&>", "text": "# Заголовок *x*\n\nстрока  \nвторая `get_job(*args)`\n\n* * *\n\n5 * 3 = 15"},
+    {"title": "Глава 3", "text": "**a *b** c* и *незакрытый\n\n***\n\n**bold *both***"},
+]
+
+
+def unpack(chunks):
+    return zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+
+def test_markdown_to_html_nests_bold_italic():
+    assert markdown_to_html("Он ***стоять*** тут") == "<p>Он <strong><em>стоять</em></strong> тут</p>"
+    assert markdown_to_html("a \\* b \\_c\\_") == "<p>a * b _c_</p>"
+    assert markdown_to_html("* * *") == "<p>* * *</p>"
+
+
+def test_epub_chapters_are_well_formed_xml():
+    book = unpack(export_epub(CHAPTERS, "Книга", uuid.uuid4()))
+    names = [n for n in book.namelist() if n.endswith((".xhtml", ".opf", ".ncx", ".xml"))]
+    assert sum(n.endswith(".xhtml") for n in names) >= len(CHAPTERS)
+    for name in names:
+        ET.fromstring(book.read(name))
+
+
+def test_zip_html_chapters_are_well_formed_xml():
+    archive = unpack(export_zip(CHAPTERS, "html"))
+    assert len(archive.namelist()) == len(CHAPTERS)
+    for name in archive.namelist():
+        ET.fromstring(archive.read(name))